@@ -1,17 +1,35 @@
+import argparse
+import bisect
 import csv
+import heapq
+import operator
 import os
 import json
+import multiprocessing
 import re
+import sys
 import dateutil.parser
 import mimetypes
 import calendar
 import urllib.parse as urlparse
 from enum import Enum
-from json_flatten import flatten
 import validators
-from publicsuffix2 import get_sld
-from datetime import datetime, timedelta
+from array import array
+from datetime import datetime
 from http.cookies import SimpleCookie, CookieError
+from domains import getSld
+from ingest import StringTable, readRequestColumns
+from splitting import splitValue
+from similarity import anyValuesAreTheSame, getRatcliffObershelpSimilarities, KOOPS_SIMILARITY_THRESHOLD
+from parsed_cache import ParsedFileCache
+from manifest import StepManifest, fingerprintFiles
+from diagnostics import diagnostics, LEVELS, DEBUG, INFO, DIAGNOSTICS_FOLDER
+from token_verdicts import TokenVerdictCache, TOKEN_VERDICTS_FOLDER
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 class EventType(Enum):
     COOKIE_READ = 1
@@ -19,27 +37,53 @@ class EventType(Enum):
     SET_COOKIE_REQUESTED = 3
     LOCAL_STORAGE_READ = 4
 
-def getSld(url):
-    return get_sld(url.replace('https://', '').replace('http://', '').split('/')[0].split('?')[0].rstrip('/'))
+# Timestamps are integer microseconds since the epoch. Document requests further apart than this start a new redirect chain.
+REDIRECT_CHAIN_GAP_US = 1000000
+
+# How top level document requests are grouped into redirect chains:
+# 'heuristic' starts a new chain after a gap of more than REDIRECT_CHAIN_GAP_US,
+# 'redirects' follows the redirects recorded in the redirectTo column (see ingest.readRequestColumns), and falls back to the heuristic for files without any.
+CHAIN_LINKING_MODES = ['heuristic', 'redirects']
+
+# 1p contexts (SLDs) interned to ints, so chain and token algorithms compare ints instead of strings.
+# Codes are only meaningful within one process; EventRow re-interns its context when it's unpickled.
+context_table = StringTable()
+
+class EventRow:
+    # Fields shared by every event that came out of the same CSV row (e.g. all the query parameters of one request),
+    # so splitting a row into many token events doesn't copy its URL, frame tree and domains into each one.
+    __slots__ = ('domain', 'ts', 'seeder_domain', 'frame_domain', 'frame_id', 'frame_domain_sld', 'domain_sld',
+        'frame_tree', 'top_level_frame_id', 'top_level_frame_domain', 'top_level_frame_domain_sld',
+        'redirect_chain_id', 'resource_type', 'query_id', 'previous_top_level_url', 'url', 'context_id')
 
-class Event:
     def get1pContext(self):
+        return context_table[self.context_id]
+
+    def setContext(self):
         # For redirects, we can't trust the event.top_level_frame_domain_sld.
         # If the request is for a document and made by the top level frame, the event.domain_sld is the real top level frame SLD.
         if self.resource_type == 'document' and self.frame_id == self.top_level_frame_id:
-            return self.domain_sld
+            context = self.domain_sld
         else:
             # We can trust this value for cookies and local storage. 
-            return self.top_level_frame_domain_sld
+            context = self.top_level_frame_domain_sld
+        self.top_level_frame_domain_sld = context
+        self.context_id = context_table.intern(context)
 
-    def __init__(self, event_type, value, name, domain, ts, seeder_domain, frame_domain, frame_id, frame_tree='',top_level_frame_id=0, top_level_frame_domain='', redirect_chain_id=-1, resource_type='', query_id=-1, previous_top_level_url='', url=''):
-        self.event_type = event_type
-        self.value = value
-        self.name = name
+    def __getstate__(self):
+        # context_id is left out, since it's a code into this process's context_table.
+        return {field: getattr(self, field) for field in EventRow.__slots__ if field != 'context_id'}
+
+    def __setstate__(self, state):
+        for field in state:
+            setattr(self, field, state[field])
+        self.context_id = context_table.intern(self.top_level_frame_domain_sld)
+
+    def __init__(self, event_type, domain, ts, seeder_domain, frame_domain, frame_id, frame_tree='',top_level_frame_id=0, top_level_frame_domain='', redirect_chain_id=-1, resource_type='', query_id=-1, previous_top_level_url='', url=''):
         self.domain = domain
         self.ts = ts
         self.seeder_domain = seeder_domain
-        self.frame_domain = frame_domain
+        self.frame_domain = sys.intern(frame_domain)
         self.frame_id = int(frame_id)
         self.frame_domain_sld = getSld(frame_domain)
         self.domain_sld = getSld(domain)
@@ -50,66 +94,283 @@ class Event:
             self.top_level_frame_domain = domain
             self.top_level_frame_domain_sld = self.frame_domain_sld
         else:
-            self.frame_tree = frame_tree
+            self.frame_tree = sys.intern(frame_tree)
             self.frame_id = int(frame_id)
             self.top_level_frame_id = int(top_level_frame_id)
-            self.top_level_frame_domain = top_level_frame_domain
+            self.top_level_frame_domain = sys.intern(top_level_frame_domain)
             self.top_level_frame_domain_sld = getSld(top_level_frame_domain)
         
         self.redirect_chain_id = redirect_chain_id
-        self.resource_type = resource_type
+        self.resource_type = sys.intern(resource_type)
         self.query_id = query_id
-        self.top_level_frame_domain_sld = self.get1pContext()
+        self.setContext()
         self.previous_top_level_url = previous_top_level_url
         self.url = url
 
+class Event:
+    # A single (name, value) token. Everything else is read from (and written to) the shared EventRow.
+    __slots__ = ('event_type', 'value', 'name', 'row')
 
-class EvasionDetector:
-    # folder = '/data/safari_results/'
-    # folder = '/data/redo_results/redone_with_clean_profile/'
+    def get1pContext(self):
+        return self.row.get1pContext()
+
+    @classmethod
+    def fromRow(cls, event_type, value, name, row):
+        event = cls.__new__(cls)
+        event.event_type = event_type
+        event.value = value
+        event.name = name
+        event.row = row
+        return event
+
+    def __init__(self, event_type, value, name, domain, ts, seeder_domain, frame_domain, frame_id, frame_tree='',top_level_frame_id=0, top_level_frame_domain='', redirect_chain_id=-1, resource_type='', query_id=-1, previous_top_level_url='', url=''):
+        self.event_type = event_type
+        self.value = value
+        self.name = name
+        self.row = EventRow(event_type, domain, ts, seeder_domain, frame_domain, frame_id, frame_tree, top_level_frame_id,
+            top_level_frame_domain, redirect_chain_id, resource_type, query_id, previous_top_level_url, url)
+
+def _rowProperty(field):
+    # Event.<field> reads and writes the row's field. This costs a Python call per read, so hot loops read event.row's fields directly.
+    return property(lambda event: getattr(event.row, field), lambda event, value: setattr(event.row, field, value))
+
+for _field in EventRow.__slots__:
+    setattr(Event, _field, _rowProperty(_field))
+
+
+class TokenDeduplicator:
+    # Hashed index of the (name, value, domain) tokens already turned into events, so ingestion can drop repeats without scanning the events.
+    def add(self, name, value, domain):
+        # Returns True if the token is new, False if it was already recorded.
+        key = (name, value, domain)
+        if key in self.recorded:
+            return False
+        self.recorded.add(key)
+        return True
+
+    def __contains__(self, key):
+        return key in self.recorded
+
+    def __len__(self):
+        return len(self.recorded)
+
+    def __init__(self):
+        self.recorded = set([])
 
-    def cookieAlreadyRecorded(self, events, cookie_name, cookie_value, cookie_domain):
+def eventTimestamp(event):
+    return event.row.ts
+
+def sortedByTimestamp(events):
+    # lib/write_results.js writes each file in time order, so this is normally just a check.
+    # If some rows are out of order anyway, sort (stably, like the global sort this replaces).
+    timestamps = [event.row.ts for event in events]
+    if all(map(operator.le, timestamps, timestamps[1:])):
+        return events
+    return sorted(events, key=eventTimestamp)
+
+def mergeEventSources(*sources):
+    # Yields the events of all sources in ts order. Events with the same ts keep the order of the sources, then their order within a source,
+    # so this gives the same order as concatenating the sources and sorting by ts.
+    return heapq.merge(*[sortedByTimestamp(events) for events in sources], key=eventTimestamp)
+
+def segmentRedirectChains(ts, frame_ids, top_level_documents, requests, contexts):
+    # The RedirectChainDetector rule and the 1p context change filter, over numpy columns with one entry per event (in ts order).
+    # Returns, as arrays: the positions of the top level document requests, the index of each one's chain,
+    # and per chain, the position of its first event, the position of the last request before it, and whether it changed the 1p context.
+    positions = numpy.flatnonzero(top_level_documents)
+    if len(positions) == 0:
+        empty = numpy.zeros(0, dtype=numpy.int64)
+        return positions, empty, empty, empty, numpy.zeros(0, dtype=bool)
+    # A new chain starts after a gap of more than REDIRECT_CHAIN_GAP_US or when the frame changes.
+    document_ts = ts[positions]
+    document_frame_ids = frame_ids[positions]
+    new_chain = numpy.empty(len(positions), dtype=bool)
+    new_chain[0] = True
+    new_chain[1:] = (numpy.diff(document_ts) > REDIRECT_CHAIN_GAP_US) | (document_frame_ids[1:] != document_frame_ids[:-1])
+    chain_idxs = numpy.cumsum(new_chain) - 1
+    chain_offsets = numpy.flatnonzero(new_chain)
+    starts = positions[chain_offsets]
+    # Position of the last request at or before each position, -1 if there isn't one.
+    last_requests = numpy.maximum.accumulate(numpy.where(requests, numpy.arange(len(requests)), -1))
+    previous_requests = numpy.where(starts > 0, last_requests[starts - 1], -1)
+    # If only storage events came before a chain, compare it with the last request of the crawl, as the old list walk did when it wrapped around.
+    previous_requests = numpy.where(previous_requests < 0, last_requests[-1], previous_requests)
+    different_context = contexts[positions] != contexts[previous_requests[chain_idxs]]
+    changed_context = numpy.logical_or.reduceat(different_context, chain_offsets)
+    return positions, chain_idxs, starts, previous_requests, changed_context
+
+class EventIndex:
+    # Positions in a step's time-sorted event list, so chains can be located without list.index() scans.
+    # Also keeps, for each position, the position of the last request before it and the event's 1p context,
+    # the storage events by 1p context, and an inverted index of token value -> positions.
+    def position(self, event):
+        return self.positions[event]
+
+    def previousRequest(self, pos):
+        # Position of the last request before pos, or 0 if there isn't one.
+        return self.previous_requests[pos]
+
+    def storageEvents(self, contexts):
+        # Cookies and localStorage reads for the surrounding events (contexts are context_ids), in event order.
+        # Note that every cookie is returned, whatever its context; only localStorage reads are filtered by context.
+        storage_positions = list(self.cookie_positions)
+        for context in contexts:
+            storage_positions += self.local_storage_positions.get(context, [])
+        storage_positions.sort()
+        return [self.events[pos] for pos in storage_positions]
+
+    def tokenContexts(self, token, positions):
+        # context_ids of the 1p contexts token was seen in, among the events at positions.
+        token_positions = self.token_positions.get(token, frozenset())
+        return set([self.contexts[pos] for pos in positions & token_positions])
+
+    def __init__(self, events):
+        self.events = events
+        self.positions = {}
+        # Columns, one entry per position, for segmentRedirectChains()
+        self.contexts = array('q')  # context_id of the event
+        self.ts = array('q')
+        self.frame_ids = array('q')
+        self.top_level_documents = array('b')  # 1 if the event is a document request of the top level frame
+        self.requests = array('b')  # 1 if the event is a request
+        self.token_positions = {}  # {token value: set of positions}
+        self.previous_requests = array('q')
+        self.cookie_positions = []
+        self.local_storage_positions = {}  # {context_id: [position]}
+        previous_request = 0
+        for pos, event in enumerate(events):
+            row = event.row
+            self.positions[event] = pos
+            self.previous_requests.append(previous_request)
+            self.contexts.append(row.context_id)
+            self.ts.append(row.ts)
+            self.frame_ids.append(row.frame_id)
+            self.top_level_documents.append(row.frame_id == row.top_level_frame_id and row.resource_type == 'document')
+            self.requests.append(event.event_type == EventType.REQUEST)
+            if event.value not in self.token_positions:
+                self.token_positions[event.value] = set([])
+            self.token_positions[event.value].add(pos)
+            if event.event_type == EventType.REQUEST:
+                previous_request = pos
+            elif event.event_type == EventType.COOKIE_READ:
+                self.cookie_positions.append(pos)
+            elif event.event_type == EventType.LOCAL_STORAGE_READ:
+                context = row.context_id
+                if context not in self.local_storage_positions:
+                    self.local_storage_positions[context] = []
+                self.local_storage_positions[context].append(pos)
+
+class OrderedChain:
+    # The events of a chain, kept in the order sortRedirectChain() returns them:
+    # requests sorted by ts (in the order they were added if the ts is the same), and each 1p context's storage events
+    # placed before the first request of each run of requests in that context (the first run also gets the storage events of its context).
+    # Requests are kept sorted as they're added and storage events are bucketed by context, so adding events never needs a full sort.
+    def add(self, event):
+        if event.event_type == EventType.COOKIE_READ or event.event_type == EventType.LOCAL_STORAGE_READ:
+            context = event.row.context_id
+            if context not in self.storage_events_by_context:
+                self.storage_events_by_context[context] = []
+            self.storage_events_by_context[context].append(event)
+        else:
+            bisect.insort_right(self.request_events, event, key=eventTimestamp)
+
+    def events(self):
+        request_events = self.request_events
+        storage_events_by_context = self.storage_events_by_context
+        current_context = request_events[0].row.context_id
+        sorted_events = []
+        if current_context in storage_events_by_context:
+            sorted_events += storage_events_by_context[current_context]
+        for request_event in request_events:
+            context = request_event.row.context_id
+            if current_context != context:
+                if context in storage_events_by_context:
+                    sorted_events += storage_events_by_context[context]
+                current_context = context
+            sorted_events.append(request_event)
+        return sorted_events
+
+    def __init__(self, events=()):
+        self.request_events = []
+        self.storage_events_by_context = {}  # {context_id: [storage events in the order they were added]}
         for event in events:
-            is_cookie = event.event_type == EventType.COOKIE_READ or event.event_type == EventType.SET_COOKIE_REQUESTED
-            if is_cookie and event.name == cookie_name and event.value == cookie_value and event.domain == cookie_domain:
-                return True
-        return False
+            self.add(event)
 
-    def maybeSplitJson(self, json_str):
-        tuples = []
-        if re.match('[0-9]+', json_str):
-            return tuples
-        try:
-            parsed_json = json.loads(json_str)
-        except json.decoder.JSONDecodeError:
-            return tuples
-        flat_json = flatten(parsed_json)
-        kv_pairs = {}
-        for key in flat_json:
-            try:
-                innermost_key = key.split('.')[-1]
-            except AttributeError:
-                innermost_key = str(key)
-            if innermost_key not in kv_pairs:
-                kv_pairs[innermost_key] = set([])
-            kv_pairs[innermost_key].add(flat_json[key])
-        
-        for key in kv_pairs:
-            for value in kv_pairs[key]:
-                tuples.append((key, value))
-        return tuples
-        
-    def maybeSplitQueryParams(self, param_str):
-        tuples = []
-        parsed_params = urlparse.parse_qs(param_str)
-        if not parsed_params:
-            # No query parameters
-            return tuples
-
-        for name in parsed_params:
-            for value in parsed_params[name]:
-                tuples.append((name, value))
-        return tuples
+def hasRecordedRedirects(events):
+    # True if some top level document request was reached through a recorded redirect.
+    for event in events:
+        row = event.row
+        if row.redirect_chain_id != -1 and row.redirect_chain_id != row.query_id:
+            return True
+    return False
+
+class RedirectChainDetector:
+    # Splits a time-ordered stream of events into redirect chains: runs of top level document requests in the same frame,
+    # each less than REDIRECT_CHAIN_GAP_US after the previous one, or with link_redirects, linked to the previous one by a recorded redirect.
+    # Only the open chain is kept in memory, though reconstructEvents() still reads the whole step first (the surrounding events need it),
+    # so in practice this is the fallback for when numpy isn't installed and for link_redirects, not a way to bound memory.
+    # push() returns the chains closed by an event and finish() the rest, as (chain_id, chain, last request before the chain).
+    def push(self, event):
+        finished = []
+        is_first_event = self.event_count == 0
+        self.event_count += 1
+        row = event.row
+        # We only care about redirect chains that happened in the top level document.
+        if row.frame_id == row.top_level_frame_id and row.resource_type == 'document':
+            # Is this event part of a new chain?
+            if self.link_redirects:
+                new_chain = len(self.chain) == 0 or row.redirect_chain_id != self.chain[-1].row.redirect_chain_id
+            else:
+                new_chain = row.ts - self.last_ts > REDIRECT_CHAIN_GAP_US
+            if new_chain or len(self.chain) == 0 or row.frame_id != self.chain[-1].row.frame_id:
+                self.closeChain(finished)
+                self.chain_id += 1
+                self.chain = [event]
+                self.chain_previous_request = self.last_request
+                self.chain_starts_stream = is_first_event
+            else:
+                self.chain.append(event)
+            self.last_ts = row.ts
+        if event.event_type == EventType.REQUEST:
+            self.last_request = event
+        return finished
+
+    def closeChain(self, finished):
+        if self.chain == []:
+            return
+        if self.chain_starts_stream:
+            # This was the document request that loaded the source page. By definition, it wasn't doing any nav racking.
+            pass
+        elif self.chain_previous_request is None:
+            # Only cookies and localStorage came before this chain. The list-based detector this replaces wrapped around
+            # to the last request of the whole crawl in that case, so hold the chain until that's known.
+            self.held_chains.append((self.chain_id, self.chain))
+        else:
+            finished.append((self.chain_id, self.chain, self.chain_previous_request))
+        self.chain = []
+
+    def finish(self):
+        finished = []
+        self.closeChain(finished)
+        for chain_id, chain in self.held_chains:
+            finished.append((chain_id, chain, self.last_request))
+        self.held_chains = []
+        return finished
+
+    def __init__(self, link_redirects=False):
+        self.link_redirects = link_redirects
+        self.event_count = 0
+        self.chain_id = 0
+        self.chain = []
+        self.chain_previous_request = None
+        self.chain_starts_stream = False
+        self.held_chains = []
+        self.last_ts = 0
+        self.last_request = None
+
+class EvasionDetector:
+    # folder = '/data/safari_results/'
+    # folder = '/data/redo_results/redone_with_clean_profile/'
 
     def cookiesFromString(self, string, top_level_frame_domain):
         cookies = []
@@ -128,135 +389,103 @@ class EvasionDetector:
                 # cookies.append({'value': cookie[c].key, 'name': 'cookie_name_for_value_'+cookie[c].value, 'domain': top_level_frame_domain})
         return cookies
 
-    def willInfinitelyRecurse(self, value):
-        # If the value is a number, maybeSplitJson will turn it into {'$float': <value>} infinitely.
-        # So if it's a number, don't try to jsonify it.
-        # Same goes for '{}': you'll get ('$empty', '{}')
-        infinite = False
-        try:
-            float(value)
-            infinite = True
-        except:
-            if value == '{}' or value == '[]':
-                infinite = True
-        return infinite
-    
     def maybeSplitValue(self, value, accumulator):
-        if not self.willInfinitelyRecurse(value):
-            json_split = self.maybeSplitJson(value)
-        else:
-            json_split = []
-        
-        query_split = self.maybeSplitQueryParams(value)
-        split = json_split + query_split
-        if split == []:
-            return []
-        accumulator += split
-        for (_, val) in split:
-            new_split = self.maybeSplitValue(val, accumulator)
-            for (new_name, new_val) in new_split:
-                if (new_name, new_val) not in accumulator:
-                    accumulator.append((new_name, new_val))
-        # Recursion over 
-        return list(set(accumulator))
+        # Adds every (name, value) pair nested in value to accumulator. Results are cached per value in splitting.splitValue.
+        accumulator += splitValue(value)
+        return accumulator
 
     def collectCookies(self, cookie_file):
         events = []
         # Collect all cookie values from cookie file
         seeder_domain = self.getSeederDomainFromFileName(cookie_file)
+        recorded = TokenDeduplicator()
         f = open(cookie_file, 'r')
         reader = csv.DictReader(f, quotechar='`')
         for row in reader:
             domain = getSld(row['domain'])
             try:
-                s = float(row['ts'])/1000
-                ts = datetime.fromtimestamp(s)
+                ts = round(float(row['ts'])*1000)
             except:
                 if row['ts'] == 'ts':
                     # This means the results-writing duplication bug happened, so stop analyzing here.
                     break
             maybe_split = []
             self.maybeSplitValue(row['value'], maybe_split)
+            # Frame domain is the same as the domain for cookies
+            event_row = EventRow(EventType.COOKIE_READ, domain, ts, seeder_domain, domain, 0, previous_top_level_url=domain)
             if not maybe_split:
-                if not self.cookieAlreadyRecorded(events, row['name'], row['value'], domain):
-                    # Frame domain is the same as the domain for cookies
-                    cookie_event = Event(EventType.COOKIE_READ, row['value'], row['name'], domain, ts, seeder_domain, domain, 0, previous_top_level_url=domain)
+                if recorded.add(row['name'], row['value'], domain):
+                    cookie_event = Event.fromRow(EventType.COOKIE_READ, row['value'], row['name'], event_row)
                     events.append(cookie_event)
             else:
                 for (key, value) in maybe_split:
-                    if not self.cookieAlreadyRecorded(events, key, value, domain):
-                        # Frame domain is the same as the domain for cookies
-                        cookie_event = Event(EventType.COOKIE_READ, value, key, domain, ts, seeder_domain, domain, 0, previous_top_level_url=domain)
+                    if recorded.add(key, value, domain):
+                        cookie_event = Event.fromRow(EventType.COOKIE_READ, value, key, event_row)
                         events.append(cookie_event)
         f.close()
         return events
     
     def collectRedirectChains(self, events):
+        # events can be any time-ordered iterable of events; chains are handled as soon as the detector closes them.
+        # reconstructEvents() always passes the full list, which is segmented with numpy instead when it's installed and chains aren't linked by redirects.
+        link_redirects = self.chain_linking == 'redirects'
+        if link_redirects and isinstance(events, list) and not hasRecordedRedirects(events):
+            # Nothing to follow (e.g. a crawl from before redirectTo was recorded), so use the heuristic.
+            link_redirects = False
+        if not link_redirects and numpy is not None and isinstance(events, list) and events:
+            return self.collectRedirectChainsFromColumns(self.eventIndexFor(events))
         redirect_chains = {}
-        redirect_chain_event_idxs = {}
-        current_chain = []
-        current_event_idxs = []
-        current_chain_id = 0
-
-        if len(events) == 0:
+        detector = RedirectChainDetector(link_redirects)
+        for event in events:
+            for chain_id, chain, previous_request_event in detector.push(event):
+                self.keepContextChangingChain(redirect_chains, chain_id, chain, previous_request_event)
+        for chain_id, chain, previous_request_event in detector.finish():
+            self.keepContextChangingChain(redirect_chains, chain_id, chain, previous_request_event)
+        if detector.event_count == 0:
             return []
-
-        last_ts = events[0].ts
-        for event_idx, event in enumerate(events):
-            # We only care about redirect chains that happened in the top level document.
-            if event.frame_id != event.top_level_frame_id:
-                continue
-            
-            if event.resource_type == 'document': 
-                # Is this event part of a new chain?
-                if event.ts - last_ts > timedelta(seconds=1) or len(current_chain) == 0 or event.frame_id != current_chain[-1].frame_id:
-                    if current_chain != []:
-                        redirect_chains[current_chain_id] = current_chain
-                    current_chain = [event]
-                    current_event_idxs = [event_idx]
-                    current_chain_id += 1
-                else:
-                    current_chain.append(event)
-                    current_event_idxs.append(event_idx)
-                last_ts = event.ts
-            if current_chain != []:
-                redirect_chains[current_chain_id] = current_chain
-                redirect_chain_event_idxs[current_chain_id] = current_event_idxs
-
-        # Remove chains that didn't cause a 1p context change
-        redirect_chains_to_return = {}
-        previous_events = {}
-        for chain_id in redirect_chains:
-            # Did this chain cause a change in 1p context?
-            first_event_idx = redirect_chain_event_idxs[chain_id][0]
-            if first_event_idx == 0:
+        # A chain can be closed out of order (see RedirectChainDetector), so return them by id.
+        return {chain_id: redirect_chains[chain_id] for chain_id in sorted(redirect_chains)}
+
+    def collectRedirectChainsFromColumns(self, event_index):
+        # Same chains as the RedirectChainDetector path, computed over the columns of event_index with numpy.
+        events = event_index.events
+        positions, chain_idxs, starts, previous_requests, changed_context = segmentRedirectChains(
+            numpy.frombuffer(event_index.ts, dtype=numpy.int64),
+            numpy.frombuffer(event_index.frame_ids, dtype=numpy.int64),
+            numpy.frombuffer(event_index.top_level_documents, dtype=numpy.int8).astype(bool),
+            numpy.frombuffer(event_index.requests, dtype=numpy.int8).astype(bool),
+            numpy.frombuffer(event_index.contexts, dtype=numpy.int64))
+        chains = [[] for _ in range(len(starts))]
+        for pos, chain_idx in zip(positions.tolist(), chain_idxs.tolist()):
+            chains[chain_idx].append(events[pos])
+        redirect_chains = {}
+        for chain_idx, chain in enumerate(chains):
+            if starts[chain_idx] == 0:
                 # This was the document request that loaded the source page. By definition, it wasn't doing any nav racking.
                 continue
-            
-            # Find the last web request and figure out what the 1p context was before the document request
-            previous_request_event = events[first_event_idx-1]
-            i = 2
-            while previous_request_event.event_type != EventType.REQUEST:
-                previous_request_event = events[first_event_idx-i]
-                i+=1
-            
-            previous_events[chain_id] = previous_request_event
-            found_different_context = False
-            for redirect_event in redirect_chains[chain_id]:
-                if previous_request_event.get1pContext() != redirect_event.get1pContext():
-                    found_different_context = True
-            
-            if found_different_context:
-                redirect_chains_to_return[chain_id] = redirect_chains[chain_id]
-
-        for cid in redirect_chains:
-            if cid not in previous_events:
-                continue
-            print(cid)
-            print('\t', previous_events[cid].query_id, previous_events[cid].get1pContext(), '(previous request)')
-            for event in redirect_chains[cid]:
-                print('\t', event.query_id, event.get1pContext())
-        return redirect_chains_to_return
+            self.recordRedirectChain(chain_idx+1, chain, events[previous_requests[chain_idx]])
+            # Remove chains that didn't cause a 1p context change
+            if changed_context[chain_idx]:
+                redirect_chains[chain_idx+1] = chain
+        return redirect_chains
+
+    def recordRedirectChain(self, chain_id, chain, previous_request_event):
+        if not diagnostics.enabled(DEBUG):
+            return
+        diagnostics.record(DEBUG, 'redirect_chain', chain_id, crawler=self.crawler,
+            previous_request=[previous_request_event.query_id, previous_request_event.get1pContext()],
+            events=[[event.query_id, event.get1pContext()] for event in chain])
+
+    def keepContextChangingChain(self, redirect_chains, chain_id, chain, previous_request_event):
+        # Remove chains that didn't cause a 1p context change
+        self.recordRedirectChain(chain_id, chain, previous_request_event)
+        found_different_context = False
+        previous_context = previous_request_event.row.context_id
+        for redirect_event in chain:
+            if previous_context != redirect_event.row.context_id:
+                found_different_context = True
+        if found_different_context:
+            redirect_chains[chain_id] = chain
 
     def addRedirectChainsToUrlChains(self, redirect_chains, crawl_file):
         seeder_plus_iteration = self.getSeederDomainFromFileName(crawl_file)
@@ -275,59 +504,47 @@ class EvasionDetector:
                 url_chain.append(event.url)
 
             url_chain_str = '_'.join([url.replace('_','-') for url in url_chain])
-            print('URL chain:', url_chain_str)
+            if diagnostics.enabled(INFO):
+                diagnostics.record(INFO, 'url_chain', cid, crawler=self.crawler, url_chain=url_chain_str)
             url_chains[seeder].add(url_chain_str)
 
     def collectQueryParamsAndSetCookies(self, crawl_file):
-        events = []
-        seeder_domain = self.getSeederDomainFromFileName(crawl_file)
-        try:
-            f = open(crawl_file, 'r')
-        except FileNotFoundError as err:
-            print('Could not open '+crawl_file)
-            return events
-        
-        reader = csv.DictReader(f, quotechar='`')
-        query_id = 0
-        for row in reader:
-            query_id += 1
-            if row['type'] == 'navigation':
-                continue
-            if row['url'] != '':
-                domain = getSld(row['url'])
-            else:
-                domain = getSld(row['expectedUrl'])
-            
-            try:
-                s = float(row['time'])/1000000.0
-                ts = datetime.fromtimestamp(s)
-            except ValueError as err:
-                if row['time'] == 'time':
-                    # The crawler had to redo the step. Discard the previous results and use the results from here on out.
-                    # This is only a temporary solution: need to do this to storage and cookies too.
-                    events = []
-                    continue
-                print('Error creating timestamp:', err)
-
-            # Update map of visited sites
-            if row['resourceType'] == 'document' or row['resourceType'] == 'sub_frame':
-                # Update map of top level sites visited
-                if row['resourceType'] == 'document':
-                    url_without_params = row['url'].split('?')[0]
-                    if url_without_params not in tl_sites_visited:
-                        tl_sites_visited[url_without_params] = 0
-                    tl_sites_visited[url_without_params] += 1
-
-            try:
-                top_level_frame_id = int(row['frameTree'].split('-')[-1])
-                frame_id = int(row['frameId'])
-            except ValueError as err:
-                print("Error in crawl events collector:", crawl_file, err)
-                continue
+        events, sites_visited = self.loadParsedFile(crawl_file, self.parseRequests)
+        for site in sites_visited:
+            if site not in tl_sites_visited:
+                tl_sites_visited[site] = 0
+            tl_sites_visited[site] += sites_visited[site]
+        return events
 
+    def parseRequests(self, crawl_file):
+        sites_visited = {}
+        request_columns = readRequestColumns(crawl_file, sites_visited)
+        if request_columns is None:
+            print('Could not open '+crawl_file)
+            return [], sites_visited
+        return self.requestEventsFromColumns(request_columns), sites_visited
+
+    def loadParsedFile(self, filename, parse):
+        # Returns parse(filename), straight from the on-disk cache if the file hasn't changed since it was last parsed.
+        if self.parsed_cache is None:
+            return parse(filename)
+        parsed = self.parsed_cache.load(filename)
+        if parsed is None:
+            parsed = parse(filename)
+            self.parsed_cache.store(filename, parsed)
+        return parsed
+
+    def requestEventsFromColumns(self, request_columns):
+        # The columns are only the parse format: every row with query parameters is turned back into an EventRow and its Events here,
+        # and the rest of the analysis runs on those objects, not on the arrays.
+        events = []
+        seeder_domain = self.getSeederDomainFromFileName(request_columns.crawl_file)
+        strings = request_columns.strings
+        for i in range(len(request_columns)):
             # Request event with query params
+            url = request_columns.urls[i]
             unique_params = []
-            parsed_url = urlparse.urlparse(row['url'])
+            parsed_url = urlparse.urlparse(url)
             parsed_params = urlparse.parse_qs(parsed_url.query)
             for param_name in parsed_params:
                 for param_val in parsed_params[param_name]:
@@ -336,16 +553,17 @@ class EvasionDetector:
                     if not maybe_split:
                         maybe_split = [(param_name, param_val)]
                     unique_params += maybe_split
+            if not unique_params:
+                continue
+            event_row = EventRow(EventType.REQUEST, strings[request_columns.domains[i]],
+                request_columns.ts[i], seeder_domain, strings[request_columns.frame_domains[i]], request_columns.frame_ids[i],
+                frame_tree = request_columns.frame_trees[i],
+                top_level_frame_domain=strings[request_columns.top_level_frame_domains[i]],
+                top_level_frame_id=request_columns.top_level_frame_ids[i],
+                resource_type=strings[request_columns.resource_types[i]], query_id=request_columns.query_ids[i],
+                url = url, redirect_chain_id=request_columns.redirect_chain_ids[i])
             for (key, value) in list(set(unique_params)):
-                request_event = Event(EventType.REQUEST, value, key, domain,
-                    ts, seeder_domain, row['frameDomain'], frame_id, frame_tree = row['frameTree'], 
-                    top_level_frame_domain=row['topLevelFrameDomain'], 
-                    top_level_frame_id=top_level_frame_id, 
-                    resource_type=row['resourceType'], query_id=query_id,
-                    url = row['url'])
-                events.append(request_event)
-                    
-        f.close()
+                events.append(Event.fromRow(EventType.REQUEST, value, key, event_row))
         return events
 
     def setPreviousUrls(self, request_events):
@@ -353,7 +571,12 @@ class EvasionDetector:
             return request_events
         previous_top_level_url = request_events[0].top_level_frame_domain
         current_top_level_url = request_events[0].top_level_frame_domain
+        previous_row = None
         for event in request_events:
+            # Events from the same request share their row, so only step through each request once.
+            if event.row is previous_row:
+                continue
+            previous_row = event.row
             if event.resource_type == 'document':
                 previous_top_level_url = current_top_level_url
                 current_top_level_url = event.top_level_frame_domain
@@ -374,6 +597,7 @@ class EvasionDetector:
         # /data/test_results/safariProfile1/localStorage/11-18-2021_2:21:52_AM_ricoh.com_localStorage.csv
         # 11-22-2021_17:41:32_PM_instagram.com_localStorage_iter1.csv
         seeder_domain = self.getSeederDomainFromFileName(ls_file)
+        recorded = TokenDeduplicator()
         try:
             f = open(ls_file, 'r')
         except FileNotFoundError as err:
@@ -383,87 +607,64 @@ class EvasionDetector:
             for row in reader:
                 domain = getSld(row['domain'])
                 try:
-                    s = float(row['ts'])/1000
-                    ts = datetime.fromtimestamp(s)
+                    ts = round(float(row['ts'])*1000)
                 except:
                     continue
                 maybe_split = []
                 self.maybeSplitValue(row['value'], maybe_split)
+                event_row = EventRow(EventType.LOCAL_STORAGE_READ, domain, ts, seeder_domain, domain, row['frameId'], previous_top_level_url=domain)
                 if not maybe_split:
-                    ls_event = Event(EventType.LOCAL_STORAGE_READ, row['value'], row['key'], domain, ts, seeder_domain, domain, row['frameId'], previous_top_level_url=domain)
-                    events.append(ls_event)
+                    if recorded.add(row['key'], row['value'], domain):
+                        ls_event = Event.fromRow(EventType.LOCAL_STORAGE_READ, row['value'], row['key'], event_row)
+                        events.append(ls_event)
                 else:
                     for (key, value) in maybe_split:
-                        ls_event = Event(EventType.LOCAL_STORAGE_READ, value, key, domain, ts, seeder_domain, domain, row['frameId'], previous_top_level_url=domain)
-                        events.append(ls_event)
+                        if recorded.add(key, value, domain):
+                            ls_event = Event.fromRow(EventType.LOCAL_STORAGE_READ, value, key, event_row)
+                            events.append(ls_event)
         except:
             self.errorFiles.append(ls_file)
         f.close()
         return events
 
     def sortRedirectChain(self, redirect_chain):
-        storage_events_by_context = {}
-        request_events = []
-        for event in redirect_chain:
-            if event.event_type == EventType.COOKIE_READ or event.event_type == EventType.LOCAL_STORAGE_READ:
-                context = event.get1pContext()
-                if context not in storage_events_by_context:
-                    storage_events_by_context[context] = []
-                storage_events_by_context[context].append(event)
-            else:
-                request_events.append(event)
+        return OrderedChain(redirect_chain).events()
 
-        request_events.sort(key=lambda event: event.ts)
-        current_context = request_events[0].get1pContext()
-        sorted_events = []
-        if current_context in storage_events_by_context:
-            for storage_event in storage_events_by_context[current_context]:
-                sorted_events.append(storage_event)
-        for request_event in request_events:
-            context = request_event.get1pContext()
-            if current_context != context:
-                if context in storage_events_by_context:
-                    for storage_event in storage_events_by_context[context]:
-                        sorted_events.append(storage_event)
-                current_context = context
-            sorted_events.append(request_event)
-        return sorted_events
+    def eventIndexFor(self, events):
+        # The index is built once per (sorted) events list and reused for all of its chains.
+        if self.event_index is None or self.event_index.events is not events:
+            self.event_index = EventIndex(events)
+        return self.event_index
 
     def eventsSurroundingChain(self, events, redirect_chain, redirect_chain_id):
-        surrounding_events = []
+        event_index = self.eventIndexFor(events)
         # Find the context before the click
-        first_event_idx = events.index(redirect_chain[0])
+        first_event_idx = event_index.position(redirect_chain[0])
         if first_event_idx != 0: # If 0, this was the document request that loaded the source page. No previous context.
             # Find the last web request and figure out what the 1p context was before the document request
-            previous_request_event = events[first_event_idx-1]
-            i = 2
-            while previous_request_event.event_type != EventType.REQUEST and first_event_idx-i >= 0:
-                previous_request_event = events[first_event_idx-i]
-                i+=1
+            previous_req_idx = event_index.previousRequest(first_event_idx)
         else:
-            previous_request_event = redirect_chain[0]
+            previous_req_idx = first_event_idx
         # Add all the events in the context before the click
-        first_context = previous_request_event.get1pContext()
-        previous_req_idx = events.index(previous_request_event)
+        first_context = events[previous_req_idx].row.context_id
         i = previous_req_idx
-        while i > 0 and events[i].get1pContext() == first_context and events[i].resource_type != 'document':
-            surrounding_events.insert(0, events[i])
+        while i > 0 and events[i].row.context_id == first_context and events[i].row.resource_type != 'document':
             i -= 1
+        surrounding_events = events[i+1:previous_req_idx+1]
         # Add all the events from the request before the redirect chain to the end of the redirect chain
-        for event in events[previous_req_idx+1:events.index(redirect_chain[-1])+1]:
-            surrounding_events.append(event)
+        last_event_idx = event_index.position(redirect_chain[-1])
+        surrounding_events += events[previous_req_idx+1:last_event_idx+1]
         # Add all the events in the context of the destination, until the context changes
-        final_context = redirect_chain[-1].get1pContext()
-        for event in events[events.index(redirect_chain[-1])+1:]:
-            if event.get1pContext() != final_context or event.resource_type == 'document':
+        final_context = redirect_chain[-1].row.context_id
+        for event in events[last_event_idx+1:]:
+            row = event.row
+            if row.context_id != final_context or row.resource_type == 'document':
                 break
             surrounding_events.append(event) 
         # And finally, because the timestamps don't quite match up, add all the cookies and local storage from the right contexts.
-        contexts = set([e.get1pContext() for e in redirect_chain])
+        contexts = set([e.row.context_id for e in redirect_chain])
         contexts.add(first_context)
-        for e in events:
-            if e.event_type == EventType.COOKIE_READ or e.event_type == EventType.LOCAL_STORAGE_READ and e.get1pContext() in contexts:
-                surrounding_events.append(e)
+        surrounding_events += event_index.storageEvents(contexts)
         
         # seen = []
         # for e in surrounding_events:
@@ -474,29 +675,36 @@ class EvasionDetector:
 
     def collectRepeatedTokensPerChain(self, events, redirect_chain, chain_id):
         surrounding_events = self.eventsSurroundingChain(events, redirect_chain, chain_id)
-        contexts_per_token = {}
-        for event in surrounding_events:
-            token = event.value
-            if token not in contexts_per_token:
-                contexts_per_token[token] = set([])
-            contexts_per_token[token].add(event.get1pContext())
+        event_index = self.eventIndexFor(events)
+        surrounding_positions = set([event_index.position(event) for event in surrounding_events])
         tokens_in_chain = set([])
         for event in redirect_chain:
             tokens_in_chain.add(event.value)
         repeated_tokens = set([])
-        for token in contexts_per_token:
+        checked_tokens = set([])
+        for event in surrounding_events:
+            token = event.value
+            if token in checked_tokens or token not in tokens_in_chain:
+                continue
+            checked_tokens.add(token)
             # A token is only repeated if it was in multiple contexts AND in the document requests.
-            if len(contexts_per_token[token]) >= 2 and token in tokens_in_chain:
+            if len(event_index.tokenContexts(token, surrounding_positions)) >= 2:
                 repeated_tokens.add(token)
         # print(repeated_tokens)
 
         # Find all events in surrounding_events that contain these tokens. 
         # Add them to the redirect chain and sort it.
+        ordered_chain = OrderedChain(redirect_chain)
+        chain_positions = set([event_index.position(event) for event in redirect_chain])
         for event in surrounding_events:
-            if event not in redirect_chain and event.value in repeated_tokens:
+            if event.value not in repeated_tokens:
+                continue
+            pos = event_index.position(event)
+            if pos not in chain_positions:
+                chain_positions.add(pos)
                 redirect_chain.append(event)
-        redirect_chain = self.sortRedirectChain(redirect_chain)
-        return redirect_chain, repeated_tokens
+                ordered_chain.add(event)
+        return ordered_chain.events(), repeated_tokens
     
     def oldCollectRepeatedTokens(self, events, redirect_chains):
         # Make a map of all tokens to the 1p contexts they belong to.
@@ -578,7 +786,7 @@ class EvasionDetector:
         return repeated_token_chains, repeated_tokens
     
     def howTokenIsUsedByDestinations(self, redirect_chain, uid_tokens_in_chain):
-        token_contexts = {} # {token: [first_context, second_context,...,nth_context]}
+        token_contexts = {} # {token: [first_context, second_context,...,nth_context]}, as context_ids until they're returned
         destination_collection_type = {} #{token: [use1, use2, use3...]}
         dst_web_requests = {} # {token: [all_web_requests in dest context that used the token]}
 
@@ -586,12 +794,21 @@ class EvasionDetector:
             if event.value not in uid_tokens_in_chain:
                 continue
             token = event.value
-            context = event.get1pContext()
+            context = event.row.context_id
             if token not in token_contexts:
                 token_contexts[token] = [context]
             if token_contexts[token][-1] != context:
                 token_contexts[token].append(context)
 
+        # {token: {context: position of its first appearance in token_contexts[token]}}
+        context_ranks = {}
+        for token in token_contexts:
+            ranks = {}
+            for rank, context in enumerate(token_contexts[token]):
+                if context not in ranks:
+                    ranks[context] = rank
+            context_ranks[token] = ranks
+
         for event in redirect_chain:
             token = event.value
             if token not in uid_tokens_in_chain:
@@ -601,15 +818,16 @@ class EvasionDetector:
             if token not in dst_web_requests:
                 dst_web_requests[token] = set([])
             # Is this event a src, st, or middle event from the point of view of its token value?
-            event_context = event.get1pContext()
-            context_idx = token_contexts[token].index(event_context)
+            row = event.row
+            event_context = row.context_id
+            context_idx = context_ranks[token][event_context]
             if context_idx == 0:
                 # Source context
                 continue
             elif context_idx == len(token_contexts[token])-1:
                 # Final destination context
-                dst = event
-                if dst.event_type == EventType.REQUEST or dst.event_type == EventType.SET_COOKIE_REQUESTED:
+                dst = row
+                if event.event_type == EventType.REQUEST or event.event_type == EventType.SET_COOKIE_REQUESTED:
                     dst_web_requests[token].add(dst.url)
                     if dst.frame_id == dst.top_level_frame_id:
                         if dst.resource_type == 'document':
@@ -625,47 +843,51 @@ class EvasionDetector:
                             destination_collection_type[token].add('iframe-subresource-request-of-destination-domain')
                         else:
                             destination_collection_type[token].add('iframe-subresource-request-of-different-domain')
-                elif dst.event_type == EventType.COOKIE_READ:
+                elif event.event_type == EventType.COOKIE_READ:
                     # If it's a cookie or local storage, it came from the top level frame
                     destination_collection_type[token].add('cookie-under-destination-domain')
                 else:
                     destination_collection_type[token].add('local-storage-under-destination-domain')
             else:
                 # Middle domain
-                if event.event_type == EventType.REQUEST and event.resource_type != 'document':
+                if event.event_type == EventType.REQUEST and row.resource_type != 'document':
                     print('ERROR: This event is a middle domain but is not a document request, I thought that was impossible.')
                 destination_collection_type[token].add('document_request_of_middle_domain')
 
+        for token in token_contexts:
+            token_contexts[token] = [context_table[context] for context in token_contexts[token]]
         return destination_collection_type, token_contexts, dst_web_requests
 
     
     def fitIntoTaxonomy(self, redirect_chain, redirect_chain_id, uid_tokens, crawlers_per_token, names_per_token, crawler=''):
-        seeder_domain = redirect_chain[0].seeder_domain
+        seeder_domain = redirect_chain[0].row.seeder_domain
 
         # URLs in redirect chain
         urls_in_redirect_chain = []
         for event in redirect_chain:
-            if event.resource_type != 'document' or '-' in event.frame_tree or (len(urls_in_redirect_chain) > 0 and urls_in_redirect_chain[-1] == event.url) or event.url == '':
+            row = event.row
+            if row.resource_type != 'document' or '-' in row.frame_tree or (len(urls_in_redirect_chain) > 0 and urls_in_redirect_chain[-1] == row.url) or row.url == '':
                 continue
             if len(urls_in_redirect_chain) == 0:
-                urls_in_redirect_chain.append(event.previous_top_level_url)
-            urls_in_redirect_chain.append(event.url)
+                urls_in_redirect_chain.append(row.previous_top_level_url)
+            urls_in_redirect_chain.append(row.url)
 
         # Contexts in which the token appeared as cookie or local storage
         # and source 3p web requests
         storage_contexts = {}
         src_web_requests = {}
-        src_context = redirect_chain[0].get1pContext()
+        src_context = redirect_chain[0].row.context_id
         for event in redirect_chain:
+            row = event.row
             token = event.value
             if token not in storage_contexts:
                 storage_contexts[token] = set([])
             if token not in src_web_requests:
                     src_web_requests[token] = set([])
-            if event.event_type == EventType.REQUEST and event.get1pContext() == src_context and event.resource_type != 'document':
-                src_web_requests[token].add(event.url)
+            if event.event_type == EventType.REQUEST and row.context_id == src_context and row.resource_type != 'document':
+                src_web_requests[token].add(row.url)
             if event.event_type == EventType.COOKIE_READ or event.event_type == EventType.LOCAL_STORAGE_READ:
-                storage_contexts[token].add(event.get1pContext())
+                storage_contexts[token].add(row.get1pContext())
 
         # How is the token used by the destinations and middle domains?
         pre_destination_collection_type, pre_contexts, pre_destination_web_requests = self.howTokenIsUsedByDestinations(redirect_chain, uid_tokens)
@@ -681,14 +903,20 @@ class EvasionDetector:
             contexts[token] = pre_contexts[token]
             destination_web_requests[token] = pre_destination_web_requests[token]
 
+        # {SLD: [URLs in the redirect chain with that SLD, in chain order]}
+        urls_by_sld = {}
+        for url in urls_in_redirect_chain:
+            sld = getSld(url)
+            if sld not in urls_by_sld:
+                urls_by_sld[sld] = []
+            urls_by_sld[sld].append(url)
+
         all_results = []
         for token in destination_collection_type:
             # Which URLs are involved in the path of each token? If a token was only passed through part of the redirect chain, these are the URLs it was passed through.
             urls_in_tokens_own_redirects = []
             for context in contexts[token]:
-                for url in urls_in_redirect_chain:
-                    if getSld(url) == context:
-                        urls_in_tokens_own_redirects.append(url)
+                urls_in_tokens_own_redirects += urls_by_sld.get(context, [])
             results = {
                 'token': token,
                 'redirect_chain_id': seeder_domain + '_' + str(redirect_chain_id),
@@ -732,12 +960,13 @@ class EvasionDetector:
     def reconstructEvents(self, files):
         request_events = self.collectQueryParamsAndSetCookies(files['extensionRequests'])
         # request_events_with_frame_domains = self.setFrameDomains(request_events)
-        events = self.setPreviousUrls(request_events)
-        events += self.collectCookies(files['cookies'])
-        events += self.collectLocalStorage(files['localStorage'])
+        request_events = self.setPreviousUrls(request_events)
+        cookie_events = self.loadParsedFile(files['cookies'], self.collectCookies)
+        local_storage_events = self.loadParsedFile(files['localStorage'], self.collectLocalStorage)
         
-        # Sort events by ts
-        events.sort(key=lambda event: event.ts)
+        # Merge the events of the three files by ts
+        events = list(mergeEventSources(request_events, cookie_events, local_storage_events))
+        self.eventIndexFor(events)
         redirect_chains = self.collectRedirectChains(events)
         if (redirect_chains == {}):
             return {}, {}, []
@@ -748,14 +977,15 @@ class EvasionDetector:
         repeated_tokens = {}
         for chain_id in redirect_chains:
             repeated_token_chain, repeated_tokens_per_chain = self.collectRepeatedTokensPerChain(events, redirect_chains[chain_id], chain_id)
-            print(repeated_tokens_per_chain)
+            if diagnostics.enabled(INFO):
+                diagnostics.record(INFO, 'repeated_tokens', chain_id, crawler=self.crawler, tokens=sorted(repeated_tokens_per_chain))
             if repeated_token_chain == []:
                 continue
             repeated_token_chains[chain_id] = repeated_token_chain
             repeated_tokens[chain_id] = repeated_tokens_per_chain
         return repeated_token_chains, repeated_tokens, redirect_chains_maybe_without_uids
     
-    def __init__(self, folder, crawler='not set'):
+    def __init__(self, folder, crawler='not set', parsed_cache=None, linking=None):
         #Folders
         self.folder = folder + '/'
         self.cookieFolder = self.folder+'cookies'
@@ -763,7 +993,74 @@ class EvasionDetector:
         self.localStorageFolder = self.folder+'localStorage'
         self.errorFiles = []
         self.crawler = crawler
-
+        self.parsed_cache = parsed_cache
+        self.chain_linking = linking if linking is not None else chain_linking
+        self.event_index = None
+
+
+# Numeric tokens inside these ranges (epoch seconds, or the same in milliseconds) are taken to be timestamps of the crawl.
+# Defaults to 2021, when the crawls ran.
+DATETIME_EPOCH_RANGE = (1609484400, 1641020400)
+# Numbers below this are taken to be relative timestamps (like from performance.now).
+RELATIVE_TIMESTAMP_LIMIT = 10000000
+
+# dateutil is slow, and slower still when it fails (it raises), which is what it does for nearly every token.
+# So the common shapes are decided with a regex first, and dateutil only sees what's left.
+# Dates these match are certainly accepted by dateutil, as long as their fields make a valid date.
+# A zone only comes after a time: dateutil rejects a date followed directly by one ('2021-01-01Z', '2021-01-01+05:30').
+ISO_DATETIME = re.compile(r'([0-9]{4})-([0-9]{2})-([0-9]{2})(?:[T ]([0-9]{2}):([0-9]{2})(?::([0-9]{2})(?:\.[0-9]{1,6})?)?(?:Z|[+-][0-9]{2}(?::?[0-9]{2})?)?)?\Z')
+RFC_2822_DATETIME = re.compile(r'(?:(?:Mon|Tue|Wed|Thu|Fri|Sat|Sun), )?([0-9]{1,2}) (Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) ([0-9]{4}) ([0-9]{2}):([0-9]{2})(?::([0-9]{2}))? (?:GMT|UTC|[+-][0-9]{4})\Z')
+RFC_2822_MONTHS = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6, 'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
+YMD_DATE = re.compile(r'([0-9]{4})([/.-])([0-9]{1,2})\2([0-9]{1,2})\Z')
+MDY_DATE = re.compile(r'([0-9]{1,2})([/.-])([0-9]{1,2})\2([0-9]{4})\Z')
+# dateutil splits a string into runs of letters, runs of digits and single other characters,
+# and gives up on any run of letters that isn't one of its words (or could be a time zone name, like 'EST').
+LETTERS = re.compile('[A-Za-z]+')
+DATEUTIL_WORDS = frozenset([word.lower() for entry in (dateutil.parser.parserinfo.JUMP + dateutil.parser.parserinfo.WEEKDAYS +
+    dateutil.parser.parserinfo.MONTHS + dateutil.parser.parserinfo.HMS + dateutil.parser.parserinfo.AMPM +
+    dateutil.parser.parserinfo.UTCZONE + dateutil.parser.parserinfo.PERTAIN)
+    for word in ([entry] if isinstance(entry, str) else entry)] + ['nan', 'inf', 'infinity'])
+DATEUTIL_MONTHS = frozenset([word.lower() for entry in dateutil.parser.parserinfo.MONTHS for word in entry])
+
+def isValidDate(year, month, day, hour=0, minute=0, second=0):
+    try:
+        datetime(year, month, day, hour, minute, second)
+    except ValueError:
+        return False
+    return True
+
+def quickDatetimeCheck(token):
+    # Returns True or False if it's certain what dateutil.parser.parse() would make of the string token, or None if only dateutil can tell.
+    match = ISO_DATETIME.match(token)
+    if match:
+        year, month, day, hour, minute, second = [int(field) if field else 0 for field in match.groups()]
+        return True if isValidDate(year, month, day, hour, minute, second) else None
+    match = RFC_2822_DATETIME.match(token)
+    if match:
+        day, month, year, hour, minute, second = match.groups()
+        valid = isValidDate(int(year), RFC_2822_MONTHS[month], int(day), int(hour), int(minute), int(second or 0))
+        return True if valid else None
+    match = YMD_DATE.match(token)
+    if match:
+        return True if isValidDate(int(match.group(1)), int(match.group(3)), int(match.group(4))) else None
+    match = MDY_DATE.match(token)
+    if match:
+        return True if isValidDate(int(match.group(4)), int(match.group(1)), int(match.group(3))) else None
+    # dateutil's tokenizer isn't ASCII only, leave anything else to it.
+    if not token.isascii():
+        return None
+    if token.isdigit():
+        # Digits alone are only a date as YYMMDDhhmmss or YYYYMMDDhhmmss (12 or 14 digits), or when short enough to be a year (or day, month...).
+        return None if len(token) in (12, 14) or len(token) < 10 else False
+    unknown_word = False
+    for word in LETTERS.findall(token):
+        lower_word = word.lower()
+        # A month name lets dateutil skip the token after it ('Jan of 2021'), so don't second guess it.
+        if lower_word in DATEUTIL_MONTHS:
+            return None
+        if lower_word not in DATEUTIL_WORDS and not (len(word) <= 5 and word.isupper()):
+            unknown_word = True
+    return False if unknown_word else None
 
 class TokenClassifier:
     def isDatetime(self, token):
@@ -771,6 +1068,9 @@ class TokenClassifier:
             return False
 
         if isinstance(token, str):
+            quick_answer = quickDatetimeCheck(token)
+            if quick_answer is not None:
+                return quick_answer
             try:
                 dateutil.parser.parse(token, ignoretz=True)
                 return True
@@ -786,19 +1086,16 @@ class TokenClassifier:
 
         # Otherwise check and see if this looks like a numberic encoding of a
         # timestamp.
-        year_start_ts = 1609484400
-        year_end_ts = 1641020400
+        year_start_ts, year_end_ts = self.epoch_range
         if float_token > year_start_ts and float_token < year_end_ts:
             return True
 
-        year_start_ts_ms = 1609484400000
-        year_end_ts_ms = 1641020400000
         # Next, see if it looks like a millisecond timestamp
-        if float_token > year_start_ts_ms and float_token < year_end_ts_ms:
+        if float_token > year_start_ts * 1000 and float_token < year_end_ts * 1000:
             return True
 
         # Finally, filter out relative timestamps (like from performance.now).
-        if float_token and float_token < 10000000:
+        if float_token and float_token < RELATIVE_TIMESTAMP_LIMIT:
             return True
 
         return False
@@ -820,8 +1117,31 @@ class TokenClassifier:
 
         return True
 
-    def __init__(self, token):
+    def __init__(self, token, epoch_range=None):
         self.token = token
+        # Read when the classifier is made, so changing DATETIME_EPOCH_RANGE takes effect.
+        self.epoch_range = DATETIME_EPOCH_RANGE if epoch_range is None else epoch_range
+
+def userTrackerTokens(tokens):
+    # The tokens for which TokenClassifier(token).isUserTracker() holds, in order, classifying each distinct token once.
+    # Verdicts are memoized in token_verdicts, so tokens seen in earlier steps (or by other strategies) aren't classified again.
+    # Verdicts made with other classifier settings don't count.
+    token_verdicts.setVersion(getTokenVerdictsVersion())
+    candidates = set([token for token in tokens if len(token) >= 8])
+    user_trackers = set([])
+    for token in candidates:
+        verdict = token_verdicts.get(token)
+        if verdict is None:
+            classifier = TokenClassifier(token)
+            if ':' not in token and '.' not in token:
+                # Without a ':' there's no URL scheme (or data: URL), and without a '.' no file extension, so only the date check can say no.
+                verdict = not classifier.isDatetime(token)
+            else:
+                verdict = classifier.isUserTracker()
+            token_verdicts.put(token, verdict)
+        if verdict:
+            user_trackers.add(token)
+    return [token for token in tokens if token in user_trackers]
 
 def crawlersPerToken(uid_tokens, names_per_crawler, redirect_chains_by_crawler):
     tokens_per_name = {}
@@ -880,53 +1200,69 @@ def removeNonUids(pre_repeated_tokens_by_crawler, pre_repeated_token_names_by_cr
             all_tokens.add(token)
     return all_tokens, repeated_tokens_by_crawler, repeated_token_names_by_crawler
 
+# Bit of each crawler in a TokenMembership mask.
+CRAWLER_BITS = {'safariProfile1': 1, 'safariProfile1Copy': 2, 'safariProfile2': 4, 'chromeProfile': 8}
+# Set on tokens that turned out to be session ids.
+SESSION_ID_BIT = 1 << 30
+
+class TokenMembership:
+    # The crawlers each token was repeated in, as one bitmask per interned token, so the cross-crawler rules are bit operations.
+    def crawlerBit(self, crawler):
+        if crawler not in self.crawler_bits:
+            self.crawler_bits[crawler] = 1 << len(self.crawler_bits)
+        return self.crawler_bits[crawler]
+
+    def setBits(self, token, bits):
+        code = self.tokens.intern(token)
+        if code == len(self.masks):
+            self.masks.append(0)
+        self.masks[code] |= bits
+
+    def mask(self, token):
+        code = self.tokens.codes.get(token)
+        return 0 if code is None else self.masks[code]
+
+    def profileMask(self, token):
+        # Condense safariProfile1 and safariProfile1Copy into one, since they use the same profile
+        mask = self.mask(token) & ~SESSION_ID_BIT
+        if mask & self.crawler_bits['safariProfile1Copy']:
+            mask = (mask & ~self.crawler_bits['safariProfile1Copy']) | self.crawler_bits['safariProfile1']
+        return mask
+
+    def inMultipleProfiles(self, token):
+        profile_mask = self.profileMask(token)
+        return profile_mask & (profile_mask - 1) != 0
+
+    def __init__(self, tokens_by_crawler):
+        self.tokens = StringTable()
+        self.masks = array('q')
+        self.crawler_bits = dict(CRAWLER_BITS)
+        for crawler in tokens_by_crawler:
+            bit = self.crawlerBit(crawler)
+            for token in tokens_by_crawler[crawler]:
+                self.setBits(token, bit)
+
 def getUidTokens(all_tokens, repeated_tokens_by_crawler, repeated_token_names_by_crawler):
-    # First, remove all tokens that are the same across any two user profiles, except s1 and s1copy.
-    non_identical_tokens = []
-    for token in all_tokens:
-        crawlers = set([])
-        for crawler in repeated_tokens_by_crawler:
-            if token in repeated_tokens_by_crawler[crawler]:
-                # Condense safariProfile1 and safariProfile1Copy into one, since they use the same profile
-                c = crawler
-                if c == 'safariProfile1Copy':
-                    c = 'safariProfile1'
-                crawlers.add(c)
-
-        if len(crawlers) > 1:
-            # If a token appears in any two profiles, since s1 and s1copy are condensed, it isn't a UID.
-            continue
-        non_identical_tokens.append(token)
+    membership = TokenMembership(repeated_tokens_by_crawler)
 
-    # Next, find all tokens that are not the same in safariProfile1 and safariProfile1Copy.
-    session_ids = []
+    # Find all tokens that are not the same in safariProfile1 and safariProfile1Copy, and mark them as session ids.
     if 'safariProfile1' in repeated_token_names_by_crawler and 'safariProfile1Copy' in repeated_token_names_by_crawler:
         for token_name in repeated_token_names_by_crawler['safariProfile1']:
             # If the same token name shows up in both crawlers, but the token value is different, the token is not a UID, it's probably a session ID or something.
             if token_name in repeated_token_names_by_crawler['safariProfile1Copy'] and repeated_token_names_by_crawler['safariProfile1'][token_name] != repeated_token_names_by_crawler['safariProfile1Copy'][token_name]:
-                session_ids.append(repeated_token_names_by_crawler['safariProfile1'][token_name])
-                session_ids.append(repeated_token_names_by_crawler['safariProfile1Copy'][token_name])
-                if 'safariProfile2' in repeated_token_names_by_crawler and token_name in repeated_token_names_by_crawler['safariProfile2']:
-                    session_ids.append(repeated_token_names_by_crawler['safariProfile2'][token_name])
-                if 'chromeProfile' in repeated_token_names_by_crawler and token_name in repeated_token_names_by_crawler['chromeProfile']:
-                    session_ids.append(repeated_token_names_by_crawler['chromeProfile'][token_name])
+                for crawler in ['safariProfile1', 'safariProfile1Copy', 'safariProfile2', 'chromeProfile']:
+                    if crawler in repeated_token_names_by_crawler and token_name in repeated_token_names_by_crawler[crawler]:
+                        membership.setBits(repeated_token_names_by_crawler[crawler][token_name], SESSION_ID_BIT)
     
-    # Remove the identical-across-profiles tokens.
-    uid_tokens_without_heuristic = []          
-    for token in non_identical_tokens:
-        if token not in session_ids:
-            uid_tokens_without_heuristic.append(token)
-   
+    # Remove all tokens that are the same across any two user profiles (except s1 and s1copy, which are condensed), and the session ids.
+    uid_tokens_without_heuristic = []
+    for token in all_tokens:
+        if membership.inMultipleProfiles(token) or membership.mask(token) & SESSION_ID_BIT:
+            continue
+        uid_tokens_without_heuristic.append(token)
 
     # Remove all tokens remaining that don't fit our heuristics for what UIDs look like.
-    uid_tokens = []
-    for token in uid_tokens_without_heuristic:
-        classifier = TokenClassifier(token)
-        if not classifier.isUserTracker():
-            continue
-        uid_tokens.append(token)
-                
-    return uid_tokens
+    return userTrackerTokens(uid_tokens_without_heuristic)
 
 # This function is used to compare our four-crawler technique to the two-crawler technique used in previous work.
 def getUidTokensByTwoCrawlersOnly(all_tokens, repeated_tokens_by_crawler, repeated_token_names_by_crawler):
@@ -935,11 +1271,14 @@ def getUidTokensByTwoCrawlersOnly(all_tokens, repeated_tokens_by_crawler, repeat
         # Fouad et al. discarded tokens that weren't in both crawls, so if no tokens were in a crawl, discard all tokens.
         return []
     
-    safari1_tokens = repeated_tokens_by_crawler['safariProfile1']
-    safari2_tokens = repeated_tokens_by_crawler['safariProfile2']
+    membership = TokenMembership(repeated_tokens_by_crawler)
+    safari1_bit = membership.crawlerBit('safariProfile1')
+    safari2_bit = membership.crawlerBit('safariProfile2')
     for token in all_tokens:
         # Token needs to be in either safari1 or safari2 but not both (if it's in both it's not a UID)
-        if token in safari1_tokens or token in safari2_tokens and not (token in safari1_tokens and token in safari2_tokens):
+        # Note that by operator precedence the "not both" only applies to the safari2 side, so tokens in both are kept too.
+        mask = membership.mask(token)
+        if mask & safari1_bit or (mask & safari2_bit and not (mask & safari1_bit and mask & safari2_bit)):
             different_tokens.add(token)
 
     return list(different_tokens)
@@ -947,33 +1286,75 @@ def getUidTokensByTwoCrawlersOnly(all_tokens, repeated_tokens_by_crawler, repeat
 # This function is used to compare our four-crawler technique to the heuristics used in previous work.
 def getUidTokensByHeuristicOnly(all_tokens, repeated_tokens_by_crawler, repeated_token_names_by_crawler):
     # Remove all tokens remaining that don't fit our heuristics for what UIDs look like.
+    return userTrackerTokens(list(all_tokens))
+
+def makeKoopsTokenDict():
+    # {context: {name: [values_across_random_walks]}} out of koops_values, each seeder step being a random walk.
+    tokens = {}
+    for context in koops_values:
+        tokens[context] = {}
+        for name in koops_values[context]:
+            values = []
+            for step in sorted(koops_values[context][name]):
+                values += sorted(koops_values[context][name][step])
+            tokens[context][name] = values
+    return tokens
+
+def getKoopsUidsOfName(group):
+    name, values = group
+    # If any values are the same across random walks, this token is not a UID according to Koop et al.
+    if anyValuesAreTheSame(values):
+        return []
     uid_tokens = []
-    for token in all_tokens:
-        classifier = TokenClassifier(token)
-        if not classifier.isUserTracker():
-            continue
-        uid_tokens.append(token)
+    similarities = getRatcliffObershelpSimilarities(values) # {value: [similarity to all other values]}
+    for value in similarities:
+        num_different = sum([1 if x <= KOOPS_SIMILARITY_THRESHOLD else 0 for x in similarities[value]])
+        if num_different >= len(similarities[value])/2:
+            # This token is a UID by Koop et al.'s definition.
+            uid_tokens.append((name, value))
     return uid_tokens
 
-def getUidsKoopsWay(all_tokens, repeated_tokens_by_crawler, repeated_token_names_by_crawler):
-    # We only need safari1 for this.
+def getUidsKoopsWay(all_tokens, repeated_tokens_by_crawler, repeated_token_names_by_crawler, workers=1):
+    # We only need safari1 for this, from every step analyzed so far (see recordKoopsValues).
     tokens = makeKoopsTokenDict() # {top_level_domain: {name: [values_across_random_walks]}}. If values are the same within a random walk that's fine but make sure to count them as one value.
+    groups = [(name, tokens[context][name]) for context in tokens for name in tokens[context]]
     uid_tokens = []
-    for context in tokens:
-        for name in tokens[context]:
-            values = tokens[context][name]
-            # If any values are the same across random walks, this token is not a UID according to Koop et al.
-            if anyValuesAreTheSame(values):
-                continue
-            similarities = getRatcliffObershelpSimilarities(values) # {value: [similarity to all other values]}
-            for value in similarities:
-                num_different = sum([1 if x <= 0.66 else 0 for x in similarities[value]])
-                if num_different >= len(similarities[value])/2:
-                    # This token is a UID by Koop et al.'s definition.
-                    uid_tokens.append((name, value))
-
+    if workers <= 1:
+        for group in groups:
+            uid_tokens += getKoopsUidsOfName(group)
+        return uid_tokens
+    # Every (context, name) is compared on its own, so they're spread over a process pool. Results come back in the order of groups.
+    with multiprocessing.Pool(workers) as pool:
+        for group_uid_tokens in pool.imap(getKoopsUidsOfName, groups, chunksize=16):
+            uid_tokens += group_uid_tokens
     return uid_tokens
 
+def recordKoopsValues(step, redirect_chains):
+    # Adds the values in safariProfile1's redirect chains of a step to koops_values.
+    for chain_id in redirect_chains:
+        for event in redirect_chains[chain_id]:
+            context = event.get1pContext()
+            if context not in koops_values:
+                koops_values[context] = {}
+            if event.name not in koops_values[context]:
+                koops_values[context][event.name] = {}
+            if step not in koops_values[context][event.name]:
+                koops_values[context][event.name][step] = set([])
+            koops_values[context][event.name][step].add(event.value)
+
+# The ways of telling UID tokens apart, by name. They all take (all_tokens, repeated_tokens_by_crawler, repeated_token_names_by_crawler).
+UID_STRATEGIES = {
+    'four_crawlers': getUidTokens,
+    'two_crawlers': getUidTokensByTwoCrawlersOnly,
+    'heuristic_only': getUidTokensByHeuristicOnly,
+    'koop': getUidsKoopsWay,
+}
+# What analyze() uses unless told otherwise.
+DEFAULT_UID_STRATEGY = 'two_crawlers'
+# These need the values of every step (and return (name, value) pairs), so they run once, after all the steps.
+CROSS_STEP_STRATEGIES = set(['koop'])
+UID_AGREEMENT_FILE = 'uid_strategy_agreement.json'
+
 def getFilesFromCrawl(safari1_cookie_file, cookie_filenames):
     # Example cookie file: 11-18-2021_12:07:32_PM_freenode.net_cookies_iter8.csv 
     prefix = safari1_cookie_file.split('_cookies')[0]  # 11-18-2021_9:55:01_AM_freenode.net
@@ -1021,135 +1402,368 @@ def getFilesFromCrawl(safari1_cookie_file, cookie_filenames):
 #                     'dst_top_level_frame_id,dst_top_level_frame_domain,dst_top_level_frame_domain_sld,dst_resource_type,dst_query_id,dst_previous_top_level_url,dst_1p_context,' + \
 #                     'transfer_type,destination_collection_type,length_of_chain,urls_in_redirect_chains,crawler'
 
+# Bump this whenever chain detection or UID classification changes, so incremental runs redo every step.
+HEURISTIC_VERSION = 1
+def getTokenVerdictsVersion():
+    # What token verdicts depend on besides the token.
+    return (HEURISTIC_VERSION, tuple(DATETIME_EPOCH_RANGE), RELATIVE_TIMESTAMP_LIMIT)
+
+# Memoized isUserTracker() verdicts, see userTrackerTokens(). Only saved between runs if given a folder (--token-verdicts).
+token_verdicts = TokenVerdictCache(getTokenVerdictsVersion())
+# One of CHAIN_LINKING_MODES, used by every EvasionDetector that isn't given one. Set by analyze().
+chain_linking = 'heuristic'
+# The UID_STRATEGIES every step is analyzed with. Set by analyze().
+uid_strategies = [DEFAULT_UID_STRATEGY]
+
 files_with_missing_doc_reqs = set([])
 current_file = ''
 tl_sites_visited = {} # Number of sites visited as top level frames
 url_chains = {}
+# Only filled in while collect_koops_values is set, since nothing but getUidsKoopsWay needs it.
+collect_koops_values = False
+koops_values = {} # {context: {name: {step: set(values)}}}, the values in safariProfile1's redirect chains across steps
+
+def reconstructEventsInWorker(args):
+    global chain_linking
+    step, crawler, crawler_files, parsed_cache, diagnostics_settings, chain_linking = args
+    # As in analyzeStepInWorker, send back what this crawler added to the globals rather than relying on the worker's copy.
+    tl_sites_visited.clear()
+    url_chains.clear()
+    diagnostics.configure(*diagnostics_settings)
+    diagnostics.beginStep(step, crawler)
+    evasion_detector = EvasionDetector('/data/test_results/'+crawler, crawler, parsed_cache)
+    print('reconstructEvents on', crawler)
+    reconstructed = evasion_detector.reconstructEvents(crawler_files)
+    diagnostics.endStep()
+    return crawler, reconstructed, dict(tl_sites_visited), dict(url_chains)
+
+def reconstructCrawlers(step, files, parsed_cache=None, crawler_workers=1):
+    # Returns {crawler: reconstructEvents() result} for every crawler of a step.
+    # The crawlers share nothing until their tokens are compared, so with more than one worker they're reconstructed concurrently in a process pool.
+    # This can't be used from inside analyzeSteps' pool, since pool workers can't start pools of their own.
+    reconstructed_by_crawler = {}
+    if crawler_workers <= 1 or len(files) <= 1:
+        for crawler in files:
+            evasion_detector = EvasionDetector('/data/test_results/'+crawler, crawler, parsed_cache)
+            print('reconstructEvents on', crawler)
+            reconstructed_by_crawler[crawler] = evasion_detector.reconstructEvents(files[crawler])
+        return reconstructed_by_crawler
+    with multiprocessing.Pool(min(crawler_workers, len(files))) as pool:
+        for crawler, reconstructed, sites_visited, chains in pool.imap(reconstructEventsInWorker, [(step, crawler, files[crawler], parsed_cache, diagnostics.settings(), chain_linking) for crawler in files]):
+            # Reconstructing events doesn't classify tokens or record Koop values, so there are none of those to merge.
+            mergeStepGlobals(sites_visited, chains, {}, {})
+            reconstructed_by_crawler[crawler] = reconstructed
+    return reconstructed_by_crawler
+
+def analyzeStep(filename, cookie_filenames, parsed_cache=None, crawler_workers=1):
+    # Runs the whole analysis for one seeder step (one safariProfile1 cookie file and its counterparts in the other crawlers).
+    # The events and chains are reconstructed once, then every per-step strategy in uid_strategies is applied to them.
+    # Returns {strategy: (uid_tokens, JSON result lines)} for the step.
+    redirect_chains_by_crawler = {}
+    repeated_tokens_by_crawler = {}
+    repeated_tokens_by_crawler_and_cid = {}
+    repeated_token_names_by_crawler = {}
+    non_uid_names = set([])
+    diagnostics.beginStep(filename)
+    
+    files = getFilesFromCrawl(filename, cookie_filenames)
+    reconstructed_by_crawler = reconstructCrawlers(filename, files, parsed_cache, crawler_workers)
+    for crawler in files:
+        current_file = files[crawler]['extensionRequests']
+        redirect_chains, repeated_tokens, _ = reconstructed_by_crawler[crawler]
+        if not redirect_chains:
+            continue
 
-def analyze():
-    # Clear outfile
-    outfile_name = 'results_two_crawlers_only_4-26.json' # '/data/test_results/test_redirect_chains_from_parallel_crawls.txt'
-    outfile = open(outfile_name, 'w')
-    outfile.close()
+        repeated_tokens_by_crawler[crawler] = set([])
+        repeated_tokens_by_crawler_and_cid[crawler] = repeated_tokens
+        redirect_chains_by_crawler[crawler] = redirect_chains
+        repeated_token_names_by_crawler[crawler] = {}
+        for cid in redirect_chains:
+            for event in redirect_chains[cid]:
+                if event.name not in repeated_token_names_by_crawler[crawler]:
+                    repeated_token_names_by_crawler[crawler][event.name] = set([])
+                repeated_token_names_by_crawler[crawler][event.name].add(event.value)
+        
+        for name in repeated_token_names_by_crawler[crawler]:
+            if len(repeated_token_names_by_crawler[crawler][name]) > 1:
+                # This is definitely not a UID.
+                non_uid_names.add(name)
 
-    # Open outfile for writing
-    outfile = open(outfile_name, 'a')
-    # outfile.write(csv_header_bounce_tracking_results+'\n')
-    # outfile.write('[\n')
+        for cid in repeated_tokens:
+            for token in repeated_tokens[cid]:
+                repeated_tokens_by_crawler[crawler].add(token)
 
+        if collect_koops_values and crawler == 'safariProfile1':
+            recordKoopsValues(filename, redirect_chains)
+        
+    all_tokens, repeated_tokens_by_crawler, repeated_token_names_by_crawler = removeNonUids(repeated_tokens_by_crawler, repeated_token_names_by_crawler, non_uid_names)
+    results_by_strategy = {}
+    for strategy in uid_strategies:
+        if strategy in CROSS_STEP_STRATEGIES:
+            continue
+        uid_tokens = UID_STRATEGIES[strategy](all_tokens, repeated_tokens_by_crawler, repeated_token_names_by_crawler)
+        print('UID tokens:', uid_tokens)
+        results_by_strategy[strategy] = (uid_tokens, getTaxonomyResults(strategy, uid_tokens, redirect_chains_by_crawler))
+    diagnostics.endStep()
+    return results_by_strategy
+
+def getTaxonomyResults(strategy, uid_tokens, redirect_chains_by_crawler):
+    # The JSON result lines of a step's redirect chains, given which of its tokens are UIDs.
+    results_lines = []
+    clean_redirect_chains_per_crawler = {}
+    clean_repeated_token_names_by_crawler = {}
+    for crawler in redirect_chains_by_crawler:
+        dirty_redirect_chains = redirect_chains_by_crawler[crawler]
+        redirect_chains = {}
+        # Remove redirect chains that contain tokens transferred across 1p contexts, but NONE of those tokens are UIDs.
+        # Also remove redirect chains that, once they have all non-UID tokens stripped from them, contain no more repeated tokens.
+        for chain_id in dirty_redirect_chains:
+            contexts_per_token = {}
+            for event in dirty_redirect_chains[chain_id]:
+                token = event.value
+                if token not in uid_tokens:
+                    continue
+                if token not in contexts_per_token:
+                    contexts_per_token[token] = set([])
+                contexts_per_token[token].add(event.row.context_id)
+            if len(contexts_per_token.keys()) == 0:
+                # No tokens were found that were UIDs
+                continue
+            max_contexts = max([len(contexts_per_token[token]) for token in contexts_per_token])
+            if max_contexts < 2:
+                print('ERROR: FOUND CHAIN WITH FEWER THAN TWO CONTEXTS')
+                continue
+            redirect_chains[chain_id] = dirty_redirect_chains[chain_id]
+        if redirect_chains != {}:
+            clean_redirect_chains_per_crawler[crawler] = redirect_chains
+            # Make a map of names to token values
+            clean_repeated_token_names_by_crawler[crawler] = {}
+            for cid in redirect_chains:
+                for event in redirect_chains[cid]:
+                    if event.value not in uid_tokens:
+                        continue
+                    clean_repeated_token_names_by_crawler[crawler][event.name] = token
+    
+    crawlers_per_token, names_per_token_per_crawler = crawlersPerToken(uid_tokens, clean_repeated_token_names_by_crawler, clean_redirect_chains_per_crawler)
+    for crawler in clean_redirect_chains_per_crawler:
+        redirect_chains = clean_redirect_chains_per_crawler[crawler]
+        if diagnostics.enabled(DEBUG):
+            seen = set([])
+            for cid in redirect_chains:
+                documents = [[redirect_chains[cid][0].query_id, redirect_chains[cid][0].get1pContext()]]
+                for event in redirect_chains[cid]:
+                    if event.resource_type != 'document' or event.query_id in seen:
+                        continue
+                    seen.add(event.query_id)
+                    documents.append([event.query_id, event.get1pContext()])
+                diagnostics.record(DEBUG, 'uid_chain', cid, crawler=crawler, strategy=strategy, documents=documents)
+
+            # The human-readable stuff
+            for chain_id in redirect_chains:
+                diagnostics.record(DEBUG, 'uid_events', chain_id, crawler=crawler, strategy=strategy, events=[{
+                    'time': datetime.fromtimestamp(event.ts/1000000).isoformat(),
+                    'line_number': event.query_id+1,
+                    'frame_tree': event.frame_tree,
+                    'event_type': event.event_type.name,
+                    'request_resource_type': event.resource_type,
+                    '1p_context': event.get1pContext(),
+                    'query_domain': event.domain,
+                    'token': event.value,
+                    'token_name': event.name
+                } for event in redirect_chains[chain_id] if event.value in uid_tokens])
+
+        # Create the JSON output file
+        evasion_detector = EvasionDetector('/data/test_results/'+crawler, crawler)
+        for chain_id in redirect_chains:
+            all_results = evasion_detector.fitIntoTaxonomy(redirect_chains[chain_id], chain_id, uid_tokens, crawlers_per_token, names_per_token_per_crawler[crawler], crawler=crawler)
+            for results in all_results:
+                json_results = json.dumps(results)
+                results_lines.append(json_results)
+    return results_lines
+
+def initStepWorker(cookie_filenames, parsed_cache, diagnostics_settings, linking, koops, strategies):
+    global worker_cookie_filenames, worker_parsed_cache, chain_linking, collect_koops_values, uid_strategies
+    worker_cookie_filenames = cookie_filenames
+    worker_parsed_cache = parsed_cache
+    diagnostics.configure(*diagnostics_settings)
+    chain_linking = linking
+    collect_koops_values = koops
+    uid_strategies = strategies
+    # The verdicts inherited from the parent are already in the parent's cache.
+    token_verdicts.takeNew()
+
+def analyzeStepInWorker(filename):
+    # Each worker process has its own copy of the globals, so start every step from empty ones and send back what the step added.
+    tl_sites_visited.clear()
+    url_chains.clear()
+    koops_values.clear()
+    results_by_strategy = analyzeStep(filename, worker_cookie_filenames, worker_parsed_cache)
+    return filename, results_by_strategy, dict(tl_sites_visited), dict(url_chains), token_verdicts.takeNew(), dict(koops_values)
+
+def mergeStepGlobals(sites_visited, chains, verdicts, step_koops_values):
+    token_verdicts.update(verdicts)
+    for context in step_koops_values:
+        if context not in koops_values:
+            koops_values[context] = {}
+        for name in step_koops_values[context]:
+            if name not in koops_values[context]:
+                koops_values[context][name] = {}
+            koops_values[context][name].update(step_koops_values[context][name])
+    for site in sites_visited:
+        if site not in tl_sites_visited:
+            tl_sites_visited[site] = 0
+        tl_sites_visited[site] += sites_visited[site]
+    for seeder in chains:
+        if seeder not in url_chains:
+            url_chains[seeder] = set([])
+        url_chains[seeder] |= chains[seeder]
+
+def analyzeSteps(filenames, cookie_filenames, parsed_cache, workers=1, crawler_workers=1):
+    # Yields (filename, {strategy: (uid_tokens, results_lines)}) for each step, in the order of filenames.
+    # With more than one worker, the steps run in a process pool and their results are streamed back here as they finish,
+    # so the caller stays the only writer and tl_sites_visited and url_chains end up with the totals over all steps.
+    # crawler_workers only applies when the steps run one at a time (see reconstructCrawlers).
+    if workers <= 1:
+        for filename in filenames:
+            yield filename, analyzeStep(filename, cookie_filenames, parsed_cache, crawler_workers)
+        return
+    with multiprocessing.Pool(workers, initializer=initStepWorker, initargs=(cookie_filenames, parsed_cache, diagnostics.settings(), chain_linking, collect_koops_values, uid_strategies)) as pool:
+        for filename, results_by_strategy, sites_visited, chains, verdicts, step_koops_values in pool.imap(analyzeStepInWorker, filenames):
+            mergeStepGlobals(sites_visited, chains, verdicts, step_koops_values)
+            yield filename, results_by_strategy
+
+def getStepFilenames(only_steps=None):
+    # only_steps restricts the run to some safariProfile1 cookie files, e.g. ['02-15-2022_13:54:12_PM_basketball-reference.com_cookies_iter3.csv']
+    step_filenames = [filename for filename in os.listdir('/data/test_results/safariProfile1/cookies') if 'failed_attempt' not in filename]
+    if only_steps:
+        step_filenames = [filename for filename in step_filenames if filename in only_steps]
+    return step_filenames
+
+def analyzeIncrementally(outfile_name, cookie_filenames, parsed_cache, workers=1, crawler_workers=1, only_steps=None):
+    # Only analyzes the steps that are new, or whose input files changed, since the last incremental run into outfile_name.
+    # Note that tl_sites_visited and url_chains only count the steps analyzed in this run.
+    # Steps analyzed with a different chain linking mode need redoing too.
+    manifest = StepManifest(outfile_name, [HEURISTIC_VERSION, chain_linking])
+    if not manifest.valid:
+        manifest.reset()
+    fingerprints = {}
+    for filename in getStepFilenames(only_steps):
+        fingerprint = fingerprintFiles(getFilesFromCrawl(filename, cookie_filenames))
+        if manifest.needsAnalysis(filename, fingerprint):
+            fingerprints[filename] = fingerprint
+    changed_steps = {}
+    for filename, results_by_strategy in analyzeSteps(list(fingerprints), cookie_filenames, parsed_cache, workers, crawler_workers):
+        _, results_lines = results_by_strategy[DEFAULT_UID_STRATEGY]
+        if filename in manifest.fingerprints:
+            # Replaced all at once at the end, since it means rewriting the results file.
+            changed_steps[filename] = (fingerprints[filename], results_lines)
+        else:
+            manifest.appendStep(filename, fingerprints[filename], results_lines)
+    if changed_steps:
+        manifest.replaceSteps(changed_steps)
+
+def getStepsPerKoopsValue():
+    # {(name, value): set(steps)}, the steps in which each of koops_values was seen.
+    steps_per_value = {}
+    for context in koops_values:
+        for name in koops_values[context]:
+            for step in koops_values[context][name]:
+                for value in koops_values[context][name][step]:
+                    if (name, value) not in steps_per_value:
+                        steps_per_value[(name, value)] = set([])
+                    steps_per_value[(name, value)].add(step)
+    return steps_per_value
+
+def getUidAgreement(uids_by_strategy):
+    # How much the strategies agree, from {strategy: set((step, token))}: for every pair of strategies,
+    # the number of UID tokens both found and the Jaccard index of their UID tokens.
+    agreement = {'uid_counts': {}, 'shared': {}, 'jaccard': {}}
+    for strategy in uids_by_strategy:
+        agreement['uid_counts'][strategy] = len(uids_by_strategy[strategy])
+        agreement['shared'][strategy] = {}
+        agreement['jaccard'][strategy] = {}
+        for other_strategy in uids_by_strategy:
+            shared = len(uids_by_strategy[strategy] & uids_by_strategy[other_strategy])
+            either = len(uids_by_strategy[strategy] | uids_by_strategy[other_strategy])
+            agreement['shared'][strategy][other_strategy] = shared
+            agreement['jaccard'][strategy][other_strategy] = shared / either if either else 1.0
+    return agreement
+
+def analyzeStrategies(step_filenames, cookie_filenames, parsed_cache, workers=1, crawler_workers=1):
+    # Analyzes every step with all of uid_strategies at once, so the events and chains are only reconstructed once.
+    # Each strategy's result lines go to results_<strategy>.json, and how much their UID tokens agree to UID_AGREEMENT_FILE.
+    # The cross-step strategies only run at the end, when the steps' chains are gone, so their files list their UIDs ({"name": ..., "value": ...}) instead.
+    koops_values.clear()
+    outfiles = {}
+    uids_by_strategy = {} # {strategy: set((step, token))}
+    for strategy in uid_strategies:
+        outfiles[strategy] = open('results_'+strategy+'.json', 'w')
+        uids_by_strategy[strategy] = set([])
+
+    for filename, results_by_strategy in analyzeSteps(step_filenames, cookie_filenames, parsed_cache, workers, crawler_workers):
+        for strategy in results_by_strategy:
+            uid_tokens, results_lines = results_by_strategy[strategy]
+            for json_results in results_lines:
+                outfiles[strategy].write(json_results+'\n')
+            for token in uid_tokens:
+                uids_by_strategy[strategy].add((filename, token))
+
+    steps_per_value = getStepsPerKoopsValue() if collect_koops_values else {}
+    for strategy in uid_strategies:
+        if strategy not in CROSS_STEP_STRATEGIES:
+            continue
+        for name, value in UID_STRATEGIES[strategy](set([]), {}, {}, workers=workers):
+            outfiles[strategy].write(json.dumps({'name': name, 'value': value})+'\n')
+            for step in steps_per_value.get((name, value), []):
+                uids_by_strategy[strategy].add((step, value))
+
+    for strategy in outfiles:
+        outfiles[strategy].close()
+    with open(UID_AGREEMENT_FILE, 'w') as f:
+        json.dump(getUidAgreement(uids_by_strategy), f, indent=1)
+
+def analyze(incremental=False, workers=1, crawler_workers=1, only_steps=None, linking='heuristic', strategies=None):
+    # With strategies (names in UID_STRATEGIES), every step is analyzed with each of them instead of DEFAULT_UID_STRATEGY alone (see analyzeStrategies).
+    # That isn't supported together with incremental.
+    global chain_linking, uid_strategies, collect_koops_values
+    if incremental and strategies:
+        raise ValueError('analyzing with several strategies is not supported incrementally')
+    chain_linking = linking
+    uid_strategies = list(dict.fromkeys(strategies)) if strategies else [DEFAULT_UID_STRATEGY]
+    collect_koops_values = any([strategy in CROSS_STEP_STRATEGIES for strategy in uid_strategies])
+    outfile_name = 'results_two_crawlers_only_4-26.json' # '/data/test_results/test_redirect_chains_from_parallel_crawls.txt'
     stats_file_name = 'tmp_stats.csv'
 
     crawlers = ['safariProfile1', 'safariProfile2', 'chromeProfile', 'safariProfile1Copy']
+    parsed_cache = ParsedFileCache()
     cookie_filenames = {
         'safariProfile1Copy': os.listdir('/data/test_results/safariProfile1Copy/cookies'),
         'safariProfile2': os.listdir('/data/test_results/safariProfile2/cookies'),
         'chromeProfile': os.listdir('/data/test_results/chromeProfile/cookies'),
     }
 
-    for filename in os.listdir('/data/test_results/safariProfile1/cookies'): # ['02-15-2022_13:54:12_PM_basketball-reference.com_cookies_iter3.csv']: #  ['02-16-2022_17:06:04_PM_instagr.am_cookies.csv', '02-16-2022_17:06:04_PM_instagr.am_cookies_iter1.csv']
-        if 'failed_attempt' in filename:
-            continue
-        redirect_chains_by_crawler = {}
-        repeated_tokens_by_crawler = {}
-        repeated_tokens_by_crawler_and_cid = {}
-        repeated_token_names_by_crawler = {}
-        non_uid_names = set([])
-        
-        files = getFilesFromCrawl(filename, cookie_filenames)
-        for crawler in files:
-            current_file = files[crawler]['extensionRequests']
-            evasion_detector = EvasionDetector('/data/test_results/'+crawler, crawler)
-            print('reconstructEvents on', crawler)
-            redirect_chains, repeated_tokens, _ = evasion_detector.reconstructEvents(files[crawler])
-            if not redirect_chains:
-                continue
+    if incremental:
+        analyzeIncrementally(outfile_name, cookie_filenames, parsed_cache, workers, crawler_workers, only_steps)
+        return
 
-            repeated_tokens_by_crawler[crawler] = set([])
-            repeated_tokens_by_crawler_and_cid[crawler] = repeated_tokens
-            redirect_chains_by_crawler[crawler] = redirect_chains
-            repeated_token_names_by_crawler[crawler] = {}
-            for cid in redirect_chains:
-                for event in redirect_chains[cid]:
-                    if event.name not in repeated_token_names_by_crawler[crawler]:
-                        repeated_token_names_by_crawler[crawler][event.name] = set([])
-                    repeated_token_names_by_crawler[crawler][event.name].add(event.value)
-            
-            for name in repeated_token_names_by_crawler[crawler]:
-                if len(repeated_token_names_by_crawler[crawler][name]) > 1:
-                    # This is definitely not a UID.
-                    non_uid_names.add(name)
+    if strategies:
+        analyzeStrategies(getStepFilenames(only_steps), cookie_filenames, parsed_cache, workers, crawler_workers)
+        return
 
-            for cid in repeated_tokens:
-                for token in repeated_tokens[cid]:
-                    repeated_tokens_by_crawler[crawler].add(token)
-            
-        all_tokens, repeated_tokens_by_crawler, repeated_token_names_by_crawler = removeNonUids(repeated_tokens_by_crawler, repeated_token_names_by_crawler, non_uid_names)
-        uid_tokens = getUidTokensByTwoCrawlersOnly(all_tokens, repeated_tokens_by_crawler, repeated_token_names_by_crawler)
-        print('UID tokens:', uid_tokens)
-
-        clean_redirect_chains_per_crawler = {}
-        clean_repeated_token_names_by_crawler = {}
-        for crawler in redirect_chains_by_crawler:
-            dirty_redirect_chains = redirect_chains_by_crawler[crawler]
-            redirect_chains = {}
-            # Remove redirect chains that contain tokens transferred across 1p contexts, but NONE of those tokens are UIDs.
-            # Also remove redirect chains that, once they have all non-UID tokens stripped from them, contain no more repeated tokens.
-            for chain_id in dirty_redirect_chains:
-                contexts_per_token = {}
-                for event in dirty_redirect_chains[chain_id]:
-                    token = event.value
-                    if token not in uid_tokens:
-                        continue
-                    if token not in contexts_per_token:
-                        contexts_per_token[token] = set([])
-                    contexts_per_token[token].add(event.get1pContext())
-                if len(contexts_per_token.keys()) == 0:
-                    # No tokens were found that were UIDs
-                    continue
-                max_contexts = max([len(contexts_per_token[token]) for token in contexts_per_token])
-                if max_contexts < 2:
-                    print('ERROR: FOUND CHAIN WITH FEWER THAN TWO CONTEXTS')
-                    continue
-                redirect_chains[chain_id] = dirty_redirect_chains[chain_id]
-            if redirect_chains != {}:
-                clean_redirect_chains_per_crawler[crawler] = redirect_chains
-                # Make a map of names to token values
-                clean_repeated_token_names_by_crawler[crawler] = {}
-                for cid in redirect_chains:
-                    for event in redirect_chains[cid]:
-                        if event.value not in uid_tokens:
-                            continue
-                        clean_repeated_token_names_by_crawler[crawler][event.name] = token
-        
-        crawlers_per_token, names_per_token_per_crawler = crawlersPerToken(uid_tokens, clean_repeated_token_names_by_crawler, clean_redirect_chains_per_crawler)
-        for crawler in clean_redirect_chains_per_crawler:
-            seen = []
-            redirect_chains = clean_redirect_chains_per_crawler[crawler]
-            for cid in redirect_chains:
-                print(crawler, 'chain:', cid)
-                print('\t', redirect_chains[cid][0].query_id, redirect_chains[cid][0].get1pContext())
-                for event in redirect_chains[cid]:
-                    if event.resource_type != 'document' or event.query_id in seen:
-                        continue
-                    seen.append(event.query_id)
-                    print('\t', event.query_id, event.get1pContext())
+    # Clear outfile
+    outfile = open(outfile_name, 'w')
+    outfile.close()
 
-            # Print the human-readable stuff
-            print(crawler, filename+':')
-            for chain_id in redirect_chains:
-                print('    Redirect chain #' + str(chain_id))
-                print('    line_number, frame_tree, event_type, request_resource_type, 1p_context, query_domain, token, token_name')
-                for event in redirect_chains[chain_id]:
-                    if event.value not in uid_tokens:
-                        continue
-                    print('       ', event.ts, event.query_id+1, event.frame_tree, event.event_type, event.resource_type, event.get1pContext(), event.domain, event.value, event.name)
+    # Open outfile for writing
+    outfile = open(outfile_name, 'a')
+    # outfile.write(csv_header_bounce_tracking_results+'\n')
+    # outfile.write('[\n')
 
-            # Create the JSON output file
-            for chain_id in redirect_chains:
-                all_results = evasion_detector.fitIntoTaxonomy(redirect_chains[chain_id], chain_id, uid_tokens, crawlers_per_token, names_per_token_per_crawler[crawler], crawler=crawler)
-                for results in all_results:
-                    json_results = json.dumps(results)
-                    outfile.write(json_results+'\n')
+    step_filenames = getStepFilenames(only_steps)
+    for filename, results_by_strategy in analyzeSteps(step_filenames, cookie_filenames, parsed_cache, workers, crawler_workers):
+        _, results_lines = results_by_strategy[DEFAULT_UID_STRATEGY]
+        for json_results in results_lines:
+            outfile.write(json_results+'\n')
         
     outfile.close()
 
@@ -1176,6 +1790,7 @@ def redirectChainsWithoutUids():
     outfile = open(outfile_name, 'a')
 
     crawlers = ['safariProfile1', 'safariProfile2', 'chromeProfile', 'safariProfile1Copy']
+    parsed_cache = ParsedFileCache()
     cookie_filenames = {
         'safariProfile1Copy': os.listdir('/data/test_results/safariProfile1Copy/cookies'),
         'safariProfile2': os.listdir('/data/test_results/safariProfile2/cookies'),
@@ -1193,8 +1808,9 @@ def redirectChainsWithoutUids():
         non_uid_names = set([])
         
         files = getFilesFromCrawl(filename, cookie_filenames)
+        diagnostics.beginStep(filename, 'without_uids')
         for crawler in files:
-            evasion_detector = EvasionDetector('/data/test_results/'+crawler, crawler)
+            evasion_detector = EvasionDetector('/data/test_results/'+crawler, crawler, parsed_cache)
             redirect_chains, repeated_tokens, chains_maybe_wo_uids = evasion_detector.reconstructEvents(files[crawler])
             if not redirect_chains:
                 continue
@@ -1218,6 +1834,7 @@ def redirectChainsWithoutUids():
             for cid in repeated_tokens:
                 for token in repeated_tokens[cid]:
                     repeated_tokens_by_crawler[crawler].add(token)
+        diagnostics.endStep()
 
         all_tokens, repeated_tokens_by_crawler, repeated_token_names_by_crawler = removeNonUids(repeated_tokens_by_crawler, repeated_token_names_by_crawler, non_uid_names)
         uid_tokens = getUidTokens(all_tokens, repeated_tokens_by_crawler, repeated_token_names_by_crawler)
@@ -1250,5 +1867,26 @@ def redirectChainsWithoutUids():
     outfile.close()
 
 if __name__ == "__main__":
-    analyze()
+    # Cached events are pickled with the classes of the 'analyze' module when this file is imported (e.g. by graph.py or a notebook).
+    # Register this module under that name too, so those entries unpickle to the same EventType members instead of a second copy of the enum.
+    sys.modules.setdefault('analyze', sys.modules[__name__])
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--incremental', action='store_true', help='Only analyze steps that are new or changed since the last --incremental run')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes to analyze steps in')
+    parser.add_argument('--crawler-workers', type=int, default=1, help='Number of processes to reconstruct the crawlers of a step in (only when --workers is 1)')
+    parser.add_argument('--step', action='append', help='Only analyze this safariProfile1 cookie file (can be repeated)')
+    parser.add_argument('--chain-linking', choices=CHAIN_LINKING_MODES, default='heuristic', help='How to group document requests into redirect chains')
+    parser.add_argument('--diagnostics', choices=list(LEVELS), default='off', help='Level of the per-step debug records to write (off by default)')
+    parser.add_argument('--diagnostics-folder', default=DIAGNOSTICS_FOLDER, help='Where to write the gzipped per-step debug records')
+    parser.add_argument('--strategy', action='append', choices=list(UID_STRATEGIES), help='Analyze with this UID strategy too, writing results_<strategy>.json for each and ' + UID_AGREEMENT_FILE + ' (can be repeated)')
+    parser.add_argument('--token-verdicts', action='store_true', help='Keep the token classifications between runs (discarded when HEURISTIC_VERSION or the timestamp ranges change)')
+    parser.add_argument('--token-verdicts-folder', default=TOKEN_VERDICTS_FOLDER, help='Where to keep the token classifications')
+    args = parser.parse_args()
+    if args.incremental and args.strategy:
+        parser.error('--strategy can\'t be used with --incremental')
+    diagnostics.configure(LEVELS[args.diagnostics], args.diagnostics_folder)
+    if args.token_verdicts:
+        token_verdicts.configure(args.token_verdicts_folder)
+    analyze(incremental=args.incremental, workers=args.workers, crawler_workers=args.crawler_workers, only_steps=args.step, linking=args.chain_linking, strategies=args.strategy)
+    token_verdicts.save()
     # redirectChainsWithoutUids()
\ No newline at end of file
@@ -0,0 +1,74 @@
+import gzip
+import json
+import os
+
+# Levels, from least to most detail.
+OFF = 0
+INFO = 1
+DEBUG = 2
+LEVELS = {'off': OFF, 'info': INFO, 'debug': DEBUG}
+
+DIAGNOSTICS_FOLDER = '/data/diagnostics/'
+# Records are kept in memory and appended to the step's file (as another gzip member) once there are this many.
+FLUSH_RECORDS = 10000
+
+class Diagnostics:
+    # Debug output of the analysis, as JSON records keyed by seeder step and chain id, instead of prints to stdout.
+    # Callers check enabled(level) before building a record, so a disabled level costs one comparison.
+    # Each step's records go to <folder>/<step>.jsonl.gz, or <folder>/<step>.<crawler>.jsonl.gz when the step's crawlers run in their own processes.
+    # Records are buffered in memory rather than in an open file, so a forked worker never shares (or flushes) its parent's file.
+    def enabled(self, level):
+        return level <= self.level
+
+    def configure(self, level, folder=DIAGNOSTICS_FOLDER):
+        self.level = level
+        self.folder = folder.rstrip('/') + '/'
+        self.step_file = None
+        self.records = []
+
+    def settings(self):
+        # To configure worker processes the same way.
+        return self.level, self.folder
+
+    def beginStep(self, step, part=None):
+        # Records are only kept between beginStep() and endStep().
+        self.records = []
+        self.step = step
+        if self.level == OFF:
+            self.step_file = None
+            return
+        name = step if part is None else step + '.' + part
+        self.step_file = self.folder + name + '.jsonl.gz'
+        os.makedirs(self.folder, exist_ok=True)
+        # Start over if the step was analyzed before.
+        if os.path.exists(self.step_file):
+            os.remove(self.step_file)
+
+    def record(self, level, kind, chain_id=None, **fields):
+        if level > self.level or self.step_file is None:
+            return
+        record = {'step': self.step, 'chain_id': chain_id, 'kind': kind}
+        record.update(fields)
+        self.records.append(record)
+        if len(self.records) >= FLUSH_RECORDS:
+            self.flush()
+
+    def flush(self):
+        if self.step_file is None or not self.records:
+            return
+        with gzip.open(self.step_file, 'at') as f:
+            for record in self.records:
+                f.write(json.dumps(record, default=str) + '\n')
+        self.records = []
+
+    def endStep(self):
+        self.flush()
+        self.step = None
+        self.step_file = None
+
+    def __init__(self, level=OFF, folder=DIAGNOSTICS_FOLDER):
+        self.step = None
+        self.configure(level, folder)
+
+# Shared by everything that runs in this process, like domains.domain_table.
+diagnostics = Diagnostics()
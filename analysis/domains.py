@@ -0,0 +1,65 @@
+from functools import lru_cache
+from publicsuffix2 import get_sld
+
+def hostFromUrl(url):
+    return url.replace('https://', '').replace('http://', '').split('/')[0].split('?')[0].rstrip('/')
+
+class DomainTable:
+    # Interns every hostname to an integer id the first time it's seen, and resolves its SLD (and, if an entity list is set, its entity) once per id.
+    # After that, lookups are list indexing. URL -> id resolution goes through a bounded LRU cache, since there are far more distinct URLs than hostnames.
+    def intern(self, host):
+        host_id = self.ids.get(host)
+        if host_id is None:
+            host_id = len(self.fqdns)
+            self.ids[host] = host_id
+            self.fqdns.append(host)
+            self.slds.append(get_sld(host))
+            self.entities.append(None)
+        return host_id
+
+    def sld(self, url):
+        return self.slds[self._idOf(url)]
+
+    def fqdn(self, url):
+        return self.fqdns[self._idOf(url)]
+
+    def setEntityList(self, entity_list):
+        self.entity_list = entity_list
+        self.entities = [None] * len(self.fqdns)
+
+    def entity(self, url):
+        host_id = self._idOf(url)
+        entity = self.entities[host_id]
+        if entity is None:
+            entity = self._resolveEntity(self.slds[host_id])
+            self.entities[host_id] = entity
+        return entity
+
+    def _resolveEntity(self, sld):
+        # Keep stripping subdomains and checking if its in the entity list
+        name = sld
+        while name.find(".") >= 0:
+            if name in self.entity_list:
+                return self.entity_list[name]
+            # Strip subdomain
+            name = name[(name.find(".")+1):]
+
+        print("Unable to find entity for " + sld)
+        return sld
+
+    def __len__(self):
+        return len(self.fqdns)
+
+    def __init__(self, max_cached_urls=1 << 18):
+        self.ids = {}  # {hostname: id}
+        self.fqdns = []  # id -> hostname
+        self.slds = []  # id -> SLD (None if publicsuffix2 can't find one)
+        self.entities = []  # id -> entity, filled in lazily
+        self.entity_list = {}
+        self._idOf = lru_cache(maxsize=max_cached_urls)(lambda url: self.intern(hostFromUrl(url)))
+
+# Shared by analyze.py, ingest.py and graph.py.
+domain_table = DomainTable()
+
+def getSld(url):
+    return domain_table.sld(url)
@@ -8,8 +8,8 @@ plt.rcParams['font.family'] = 'sans-serif'
 plt.rcParams['pdf.fonttype'] = 42
 plt.rcParams['ps.fonttype'] = 42
 import numpy as np
-from publicsuffix2 import get_sld
 import os
+from domains import getSld, domain_table
 
 def uidCertaintyLevel(filename):
     f = open(filename, 'r')
@@ -305,9 +305,6 @@ def sortBars(value_dict):
     numbers, names = [list(t) for t in zip(*sorted_pairs)]
     return numbers, names
 
-def getSld(url):
-    return get_sld(url.replace('https://', '').replace('http://', '').split('/')[0].split('?')[0].rstrip('/'))
-
 def navTrackerDomains(filename):
     f = open(filename)
     src_domains = {}
@@ -415,7 +412,7 @@ def cleanJsonFile():
     f.close()
 
 def getDomain(url):
-    return url.replace('https://', '').replace('http://', '').split('/')[0].split('?')[0].rstrip('/')
+    return domain_table.fqdn(url)
 
 def middleDomainsWithoutUids():
     f = open('all_bounce_tracking_without_uids.csv', 'r')
@@ -827,33 +824,23 @@ def create_entity_list():
 
 # entity_list = transform_entity_list(get_disconnect_entity_list())
 entity_list = create_entity_list()
+domain_table.setEntityList(entity_list)
 
 def get_entity(url):
-    sld = getSld(url)
-
-    # Keep stripping subdomains and checking if its in the entity list
-    while sld.find(".") >= 0:
-        if sld in entity_list:
-            return entity_list[sld]
-
-        # Strip subdomain
-        sld = sld[(sld.find(".")+1):]
-
-    print("Unable to find entity for " + getSld(url))
-    return getSld(url)
+    return domain_table.entity(url)
 
 def origsAndDestsInDisconnect():
     srcs, dsts = numbersOfChains()
     in_disconnect = set([])
     slds = set([])
     for src in srcs:
-        slds.add(get_sld(src))
+        slds.add(getSld(src))
         if get_entity(src):
-            in_disconnect.add(get_sld(src))
+            in_disconnect.add(getSld(src))
     for dst in dsts:
-        slds.add(get_sld(dst))
+        slds.add(getSld(dst))
         if get_entity(dst):
-            in_disconnect.add(get_sld(dst))
+            in_disconnect.add(getSld(dst))
 
     print('Srcs+dsts in disconnect:', len(in_disconnect), 'total:', len(slds))
 
@@ -866,7 +853,7 @@ def numAdditionalEntitySlds():
     with open('analysis/additional_entities.csv') as f:
         reader = csv.DictReader(f, quotechar='"')
         for row in reader:
-            slds.add(get_sld(row['url']))
+            slds.add(getSld(row['url']))
     print(len(slds))
 
 def websiteFreqs():
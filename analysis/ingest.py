@@ -0,0 +1,138 @@
+import csv
+import urllib.parse as urlparse
+from array import array
+from domains import getSld
+
+# Columns of lib/write_results.js writeCrawlEvents() that the analysis actually reads.
+REQUEST_COLUMNS = ['url', 'type', 'time', 'frameId', 'frameDomain', 'frameTree', 'topLevelFrameDomain', 'expectedUrl', 'resourceType']
+# Read if the file has them. redirectTo is the Location header of a document response (lib/crawl.js responseListener).
+# isRedirect isn't used: the crawler's check for it only ever looks at the first event, so it's almost never set.
+OPTIONAL_REQUEST_COLUMNS = ['redirectTo']
+
+class StringTable:
+    # Interns strings to small integer codes so columns can store ints instead of repeated strings.
+    def intern(self, string):
+        code = self.codes.get(string)
+        if code is None:
+            code = len(self.strings)
+            self.codes[string] = code
+            self.strings.append(string)
+        return code
+
+    def __getitem__(self, code):
+        return self.strings[code]
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __init__(self):
+        self.strings = []
+        self.codes = {}
+
+class RequestColumns:
+    # One entry per non-navigation row of an extensionRequests file, stored column by column.
+    def clear(self):
+        self.urls = []
+        self.ts = array('q')  # microseconds since the epoch
+        self.frame_ids = array('q')
+        self.top_level_frame_ids = array('q')
+        self.query_ids = array('q')
+        self.frame_trees = []
+        self.domains = array('l')  # codes into self.strings, SLD of url (or expectedUrl)
+        self.frame_domains = array('l')
+        self.top_level_frame_domains = array('l')
+        self.resource_types = array('l')
+        # For top level document requests, the query_id of the first request of the recorded redirects that led here (its own if none did), -1 otherwise.
+        self.redirect_chain_ids = array('q')
+
+    def append(self, url, ts, frame_id, top_level_frame_id, query_id, frame_tree, domain, frame_domain, top_level_frame_domain, resource_type, redirect_chain_id=-1):
+        self.urls.append(url)
+        self.ts.append(ts)
+        self.frame_ids.append(frame_id)
+        self.top_level_frame_ids.append(top_level_frame_id)
+        self.query_ids.append(query_id)
+        self.frame_trees.append(frame_tree)
+        self.domains.append(self.strings.intern(domain))
+        self.frame_domains.append(self.strings.intern(frame_domain))
+        self.top_level_frame_domains.append(self.strings.intern(top_level_frame_domain))
+        self.resource_types.append(self.strings.intern(resource_type))
+        self.redirect_chain_ids.append(redirect_chain_id)
+
+    def __len__(self):
+        return len(self.ts)
+
+    def __init__(self, crawl_file):
+        self.crawl_file = crawl_file
+        self.strings = StringTable()
+        self.clear()
+
+def readRequestColumns(crawl_file, sites_visited=None):
+    # Streams an extensionRequests CSV into a RequestColumns. Returns None if the file doesn't exist.
+    # If sites_visited is given, it counts the top level documents requested, keyed by URL without params.
+    try:
+        f = open(crawl_file, 'r')
+    except FileNotFoundError:
+        return None
+
+    columns = RequestColumns(crawl_file)
+    reader = csv.reader(f, quotechar='`')
+    header = next(reader, None)
+    if header is None:
+        f.close()
+        return columns
+    idx = [header.index(name) for name in REQUEST_COLUMNS]
+    (url_idx, type_idx, time_idx, frame_id_idx, frame_domain_idx, frame_tree_idx,
+        top_level_frame_domain_idx, expected_url_idx, resource_type_idx) = idx
+    min_len = max(idx) + 1
+    redirect_to_idx = header.index('redirectTo') if 'redirectTo' in header else None
+
+    # {(frame id, URL): redirect_chain_id} of the redirects recorded so far whose target hasn't been requested yet.
+    next_hops = {}
+    query_id = 0
+    ts = 0
+    for row in reader:
+        query_id += 1
+        if len(row) < min_len or row[type_idx] == 'navigation':
+            continue
+        url = row[url_idx]
+        host_url = url if url != '' else row[expected_url_idx]
+        domain = getSld(host_url)
+
+        time = row[time_idx]
+        try:
+            ts = round(float(time))
+        except ValueError as err:
+            if time == 'time':
+                # The crawler had to redo the step. Discard the previous results and use the results from here on out.
+                columns.clear()
+                next_hops = {}
+                continue
+            print('Error creating timestamp:', err)
+
+        resource_type = row[resource_type_idx]
+        if sites_visited is not None and resource_type == 'document':
+            url_without_params = url.split('?')[0]
+            sites_visited[url_without_params] = sites_visited.get(url_without_params, 0) + 1
+
+        frame_tree = row[frame_tree_idx]
+        try:
+            top_level_frame_id = int(frame_tree.split('-')[-1])
+            frame_id = int(row[frame_id_idx])
+        except ValueError as err:
+            print("Error in crawl events collector:", crawl_file, err)
+            continue
+
+        redirect_chain_id = -1
+        if resource_type == 'document' and frame_id == top_level_frame_id:
+            # Follow the recorded redirects: a request for the URL a previous response in this frame redirected to continues its chain.
+            redirect_chain_id = next_hops.pop((frame_id, urlparse.urldefrag(host_url)[0]), -1)
+            if redirect_chain_id == -1:
+                redirect_chain_id = query_id
+            redirect_to = row[redirect_to_idx] if redirect_to_idx is not None and len(row) > redirect_to_idx else ''
+            if redirect_to != '':
+                next_hops[(frame_id, urlparse.urldefrag(urlparse.urljoin(host_url, redirect_to))[0])] = redirect_chain_id
+
+        columns.append(url, ts, frame_id, top_level_frame_id, query_id, frame_tree, domain,
+            row[frame_domain_idx], row[top_level_frame_domain_idx], resource_type, redirect_chain_id)
+    f.close()
+    return columns
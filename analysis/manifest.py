@@ -0,0 +1,116 @@
+import json
+import os
+
+def fingerprintFiles(files_by_crawler):
+    # {crawler: {file_kind: [size, mtime_ns] or None if missing}} for every input file of a step.
+    fingerprint = {}
+    for crawler in sorted(files_by_crawler):
+        fingerprint[crawler] = {}
+        for kind in sorted(files_by_crawler[crawler]):
+            try:
+                stat = os.stat(files_by_crawler[crawler][kind])
+                fingerprint[crawler][kind] = [stat.st_size, stat.st_mtime_ns]
+            except FileNotFoundError:
+                fingerprint[crawler][kind] = None
+    return fingerprint
+
+def replaceFile(path, lines):
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        for line in lines:
+            f.write(line+'\n')
+    os.replace(tmp_path, path)
+
+class StepManifest:
+    # Records which seeder steps a results file already contains, with the input fingerprints and heuristic version they were analyzed with.
+    # The results file keeps each step's lines together, in manifest order, so a step's lines can be found (and replaced) from the line counts alone.
+    # The manifest is stored next to the results file as <results file>.manifest.json.
+    def load(self):
+        self.valid = False
+        self.steps = []
+        self.fingerprints = {}
+        self.line_counts = {}
+        try:
+            with open(self.manifest_name, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        try:
+            results_size = os.path.getsize(self.results_name)
+        except OSError:
+            return
+        # If the heuristics changed, or the results file doesn't match what the manifest recorded (e.g. a run was killed between writing the two), start over.
+        if manifest.get('heuristic_version') != self.heuristic_version or manifest.get('results_size') != results_size:
+            return
+        for step, fingerprint, line_count in manifest['steps']:
+            self.steps.append(step)
+            self.fingerprints[step] = fingerprint
+            self.line_counts[step] = line_count
+        self.valid = True
+
+    def needsAnalysis(self, step, fingerprint):
+        return self.fingerprints.get(step) != fingerprint
+
+    def appendStep(self, step, fingerprint, lines):
+        # Adds the results of a step that isn't in the results file yet.
+        with open(self.results_name, 'a') as f:
+            for line in lines:
+                f.write(line+'\n')
+        self.steps.append(step)
+        self.fingerprints[step] = fingerprint
+        self.line_counts[step] = len(lines)
+        self.save()
+
+    def replaceSteps(self, results_by_step):
+        # {step: (fingerprint, lines)}. Rewrites the results file with these steps' old lines swapped for the new ones,
+        # so readers see either the old file or the new one, never a mix.
+        old_lines = []
+        if self.steps:
+            with open(self.results_name, 'r') as f:
+                old_lines = f.read().splitlines()
+        new_lines = []
+        offset = 0
+        for step in self.steps:
+            line_count = self.line_counts[step]
+            if step in results_by_step:
+                fingerprint, lines = results_by_step[step]
+                self.fingerprints[step] = fingerprint
+                self.line_counts[step] = len(lines)
+                new_lines += lines
+            else:
+                new_lines += old_lines[offset:offset+line_count]
+            offset += line_count
+        for step in results_by_step:
+            if step not in self.line_counts:
+                fingerprint, lines = results_by_step[step]
+                self.steps.append(step)
+                self.fingerprints[step] = fingerprint
+                self.line_counts[step] = len(lines)
+                new_lines += lines
+        replaceFile(self.results_name, new_lines)
+        self.save()
+
+    def reset(self):
+        self.valid = True
+        self.steps = []
+        self.fingerprints = {}
+        self.line_counts = {}
+        replaceFile(self.results_name, [])
+        self.save()
+
+    def save(self):
+        manifest = {
+            'heuristic_version': self.heuristic_version,
+            'results_size': os.path.getsize(self.results_name),
+            'steps': [[step, self.fingerprints[step], self.line_counts[step]] for step in self.steps]
+        }
+        tmp_name = self.manifest_name + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_name, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_name, self.manifest_name)
+
+    def __init__(self, results_name, heuristic_version):
+        self.results_name = results_name
+        self.manifest_name = results_name + '.manifest.json'
+        self.heuristic_version = heuristic_version
+        self.load()
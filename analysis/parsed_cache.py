@@ -0,0 +1,55 @@
+import hashlib
+import os
+import pickle
+
+CACHE_FOLDER = '/data/parsed_cache/'
+# Bump this whenever parsing or value splitting changes what ends up in the events, so old entries are ignored.
+PARSER_VERSION = 3
+
+class ParsedFileCache:
+    # On-disk cache of whatever was parsed out of a crawl CSV, keyed by the file's path, size and mtime.
+    # An entry is only used if the file still has the same size and mtime and it was written by the same PARSER_VERSION.
+    def fingerprint(self, filename):
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            return None
+        return (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns, PARSER_VERSION)
+
+    def entryPath(self, filename):
+        return self.folder + hashlib.sha1(os.path.abspath(filename).encode()).hexdigest() + '.pickle'
+
+    def load(self, filename):
+        # Returns the cached value for filename, or None if there isn't a valid one.
+        fingerprint = self.fingerprint(filename)
+        if fingerprint is None:
+            return None
+        # The fingerprint is pickled separately, ahead of the value, so a stale entry (maybe of classes that have changed since) is never unpickled.
+        try:
+            with open(self.entryPath(filename), 'rb') as f:
+                if pickle.load(f) != fingerprint:
+                    return None
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, TypeError, ValueError):
+            return None
+        self.hits += 1
+        return value
+
+    def store(self, filename, value):
+        fingerprint = self.fingerprint(filename)
+        if fingerprint is None:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        entry_path = self.entryPath(filename)
+        # Write to a temporary file and rename, so parallel runs never see a half-written entry.
+        tmp_path = entry_path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(fingerprint, f, protocol=5)
+            pickle.dump(value, f, protocol=5)
+        os.replace(tmp_path, entry_path)
+        self.misses += 1
+
+    def __init__(self, folder=CACHE_FOLDER):
+        self.folder = folder.rstrip('/') + '/'
+        self.hits = 0
+        self.misses = 0
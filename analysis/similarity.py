@@ -0,0 +1,31 @@
+from difflib import SequenceMatcher
+
+# Koop et al. take two values of a parameter to be different if their Ratcliff/Obershelp similarity is at most this.
+KOOPS_SIMILARITY_THRESHOLD = 0.66
+
+def anyValuesAreTheSame(values):
+    return len(set(values)) < len(values)
+
+def getRatcliffObershelpSimilarities(values, threshold=KOOPS_SIMILARITY_THRESHOLD):
+    # {value: [similarity to each other value, in the order of values]}, by difflib's ratio(), for distinct values.
+    # Only which side of threshold a similarity is on matters, so a pair whose upper bound is already at or below it
+    # gets the bound instead of the ratio: first the one from the lengths alone (real_quick_ratio()), then the one from the character counts (quick_ratio()).
+    # Similarities above threshold are always exact.
+    values = list(values)
+    similarities = {value: [] for value in values}
+    matcher = SequenceMatcher(None)
+    for j in range(1, len(values)):
+        b = values[j]
+        # The matcher caches what it learns about its second sequence, so b stays put while we go over the values before it.
+        matcher.set_seq2(b)
+        for i in range(j):
+            a = values[i]
+            similarity = 2.0 * min(len(a), len(b)) / (len(a) + len(b))
+            if similarity > threshold:
+                matcher.set_seq1(a)
+                similarity = matcher.quick_ratio()
+                if similarity > threshold:
+                    similarity = matcher.ratio()
+            similarities[a].append(similarity)
+            similarities[b].append(similarity)
+    return similarities
@@ -0,0 +1,129 @@
+import json
+import re
+import urllib.parse as urlparse
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Limits on how far a single value gets split. Real cookies and query parameters stay far below these;
+# they only stop pathological values (deeply nested or self-similar encodings) from blowing up.
+MAX_SPLIT_DEPTH = 32
+MAX_SPLIT_TOKENS = 10000
+SPLIT_CACHE_SIZE = 1 << 16
+
+LONG_INTEGER = re.compile('[0-9]{19}')
+
+def loadJson(json_str):
+    # Returns the parsed JSON, or None if json_str isn't valid JSON.
+    # orjson turns integers that don't fit in 64 bits into floats, which would change the token, so leave those to the stdlib.
+    if orjson is not None and not LONG_INTEGER.search(json_str):
+        try:
+            return orjson.loads(json_str)
+        except orjson.JSONDecodeError:
+            # orjson is stricter than the stdlib (NaN, integers over 64 bits), so let the stdlib have a go before giving up.
+            pass
+    try:
+        return json.loads(json_str)
+    except ValueError:
+        return None
+
+def addInnermostPairs(obj, key, kv_pairs):
+    # Walks obj the way json_flatten.flatten() does, but only keeps the innermost key (the part of the flattened key after the last '.'),
+    # so we don't build the full dotted keys just to split them again.
+    if isinstance(obj, dict):
+        if not obj:
+            addPair(kv_pairs, key + '$empty', '{}')
+        for child_key, item in obj.items():
+            addInnermostPairs(item, child_key, kv_pairs)
+    elif isinstance(obj, (list, tuple)):
+        if len(obj) == 0:
+            addPair(kv_pairs, key + '$emptylist', '[]')
+        for i, item in enumerate(obj):
+            addInnermostPairs(item, '[' + str(i) + ']', kv_pairs)
+    elif obj is None:
+        addPair(kv_pairs, key + '$none', 'None')
+    elif isinstance(obj, bool):
+        addPair(kv_pairs, key + '$bool', str(obj))
+    elif isinstance(obj, int):
+        addPair(kv_pairs, key + '$int', str(obj))
+    elif isinstance(obj, float):
+        addPair(kv_pairs, key + '$float', str(obj))
+    else:
+        addPair(kv_pairs, key, str(obj))
+
+def addPair(kv_pairs, key, value):
+    innermost_key = key.rpartition('.')[2]
+    if innermost_key not in kv_pairs:
+        kv_pairs[innermost_key] = set([])
+    kv_pairs[innermost_key].add(value)
+
+def maybeSplitJson(json_str):
+    tuples = []
+    # Only JSON objects have names to split on. Anything else (numbers, strings, lists) isn't split.
+    parsed_json = loadJson(json_str)
+    if not isinstance(parsed_json, dict):
+        return tuples
+    kv_pairs = {}
+    addInnermostPairs(parsed_json, '', kv_pairs)
+
+    for key in kv_pairs:
+        for value in kv_pairs[key]:
+            tuples.append((key, value))
+    return tuples
+
+def maybeSplitQueryParams(param_str):
+    tuples = []
+    parsed_params = urlparse.parse_qs(param_str)
+    if not parsed_params:
+        # No query parameters
+        return tuples
+
+    for name in parsed_params:
+        for value in parsed_params[name]:
+            tuples.append((name, value))
+    return tuples
+
+def classifyValue(value):
+    # One cheap look at a value, so we only run the parsers on values that could actually split.
+    # Returns (could be a JSON object, could be a query string).
+    # '{}' is excluded because it splits into ('$empty', '{}') forever.
+    maybe_json = value.lstrip()[:1] == '{' and value != '{}'
+    # parse_qs only returns something if there's at least one name=value pair.
+    maybe_query = '=' in value
+    return maybe_json, maybe_query
+
+def splitOnce(value):
+    maybe_json, maybe_query = classifyValue(value)
+    split = maybeSplitJson(value) if maybe_json else []
+    if maybe_query:
+        split += maybeSplitQueryParams(value)
+    return split
+
+@lru_cache(maxsize=SPLIT_CACHE_SIZE)
+def splitValue(value):
+    # Returns every (name, value) pair nested inside value (as JSON and/or query parameters, to any depth),
+    # in the order a depth-first walk finds them, without duplicates. Returns () if value can't be split.
+    tuples = []
+    seen_tuples = set([])
+    expanded_values = set([])
+    stack = [(value, 0)]
+    while stack:
+        current, depth = stack.pop()
+        # Expanding a value a second time can only produce pairs we already have.
+        if current in expanded_values:
+            continue
+        expanded_values.add(current)
+        split = splitOnce(current)
+        for pair in split:
+            if pair not in seen_tuples:
+                seen_tuples.add(pair)
+                tuples.append(pair)
+        if depth >= MAX_SPLIT_DEPTH or len(tuples) >= MAX_SPLIT_TOKENS:
+            continue
+        for (_, val) in reversed(split):
+            if val not in expanded_values:
+                stack.append((val, depth+1))
+    return tuple(tuples)
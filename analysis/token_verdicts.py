@@ -0,0 +1,78 @@
+import os
+import pickle
+from collections import OrderedDict
+
+TOKEN_VERDICTS_FOLDER = '/data/token_verdicts/'
+# Verdicts kept in memory; the least recently used ones are dropped past this.
+TOKEN_VERDICTS_SIZE = 1 << 20
+
+class TokenVerdictCache:
+    # Bounded memo of {token: whether TokenClassifier(token).isUserTracker()}, since the same values recur across steps and strategies.
+    # If given a folder, it's loaded from and saved to <folder>/verdicts.pickle, and a saved cache is only used if it was
+    # written with the same version (the heuristic version and classifier settings).
+    def get(self, token):
+        # Returns the verdict for token, or None if there isn't one.
+        verdict = self.verdicts.get(token)
+        if verdict is not None:
+            self.verdicts.move_to_end(token)
+        return verdict
+
+    def put(self, token, verdict):
+        self.verdicts[token] = verdict
+        self.verdicts.move_to_end(token)
+        self.new_verdicts[token] = verdict
+        if len(self.verdicts) > self.max_size:
+            self.verdicts.popitem(last=False)
+        if len(self.new_verdicts) > self.max_size:
+            self.new_verdicts.popitem(last=False)
+
+    def update(self, verdicts):
+        for token in verdicts:
+            self.put(token, verdicts[token])
+
+    def takeNew(self):
+        # Returns the verdicts added since the last call (or load), e.g. to send them from a worker process back to the parent.
+        new_verdicts = dict(self.new_verdicts)
+        self.new_verdicts = OrderedDict()
+        return new_verdicts
+
+    def setVersion(self, version):
+        # Drops every verdict if they were made under another version.
+        if version == self.version:
+            return
+        self.version = version
+        self.verdicts = OrderedDict()
+        self.new_verdicts = OrderedDict()
+
+    def configure(self, folder=None):
+        self.folder = None if folder is None else folder.rstrip('/') + '/'
+        self.verdicts = OrderedDict()
+        self.new_verdicts = OrderedDict()
+        if self.folder is None:
+            return
+        # The version is pickled separately, ahead of the verdicts, like the entries of the parsed file cache.
+        try:
+            with open(self.folder + 'verdicts.pickle', 'rb') as f:
+                if pickle.load(f) != self.version:
+                    return
+                verdicts = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, TypeError, ValueError):
+            return
+        for token in verdicts:
+            self.verdicts[token] = verdicts[token]
+
+    def save(self):
+        if self.folder is None:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        path = self.folder + 'verdicts.pickle'
+        tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self.version, f, protocol=5)
+            pickle.dump(dict(self.verdicts), f, protocol=5)
+        os.replace(tmp_path, path)
+
+    def __init__(self, version, folder=None, max_size=TOKEN_VERDICTS_SIZE):
+        self.version = version
+        self.max_size = max_size
+        self.configure(folder)